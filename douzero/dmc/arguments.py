@@ -9,6 +9,8 @@ parser.add_argument('--save_interval', default=30, type=int,
                     help='Time interval (in minutes) at which to save the model')    
 parser.add_argument('--objective', default='adp', type=str, choices=['adp', 'wp'],
                     help='Use ADP or WP as reward (default: ADP)')    
+parser.add_argument('--model_type', default='lstm', type=str, choices=['lstm', 'factored', 'two_tower', 'student'],
+                    help='Model family: lstm, factored (lstm with a factored first layer), two_tower or student (default: lstm)')
 
 # Training settings
 parser.add_argument('--gpu_devices', default='0', type=str,
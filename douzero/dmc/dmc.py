@@ -76,7 +76,7 @@ def train(flags):
     models = []
     assert flags.num_actor_devices <= len(flags.gpu_devices.split(',')), 'The number of actor devices can not exceed the number of available devices'
     for device in range(flags.num_actor_devices):
-        model = Model(device=device)
+        model = Model(device=device, model_type=flags.model_type)
         model.share_memory()
         model.eval()
         models.append(model)
@@ -96,7 +96,7 @@ def train(flags):
         full_queue.append(_full_queue)
 
     # Learner model for training
-    learner_model = Model(device=flags.training_device)
+    learner_model = Model(device=flags.training_device, model_type=flags.model_type)
 
     # Create optimizers
     optimizers = create_optimizers(flags, learner_model)
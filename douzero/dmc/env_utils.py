@@ -14,7 +14,8 @@ def _format_observation(obs, device):
     position = obs['position']
     device = torch.device('cuda:'+str(device))
     x_batch = torch.from_numpy(obs['x_batch']).to(device)
-    z_batch = torch.from_numpy(obs['z_batch']).to(device)
+    # z_batch repeats one row, and the model broadcasts a batch of 1
+    z_batch = torch.from_numpy(obs['z_batch'][:1].copy()).to(device)
     x_no_action = torch.from_numpy(obs['x_no_action'])
     z = torch.from_numpy(obs['z'])
     obs = {'x_batch': x_batch,
@@ -1,12 +1,19 @@
 """
 This file includes the torch models. We wrap the three
 models into one class for convenience.
+
+The models take `z` either as a batch with one history per
+action, or as a batch of size 1 that is shared by all the
+actions in `x`. The latter runs the LSTM only once. To score
+the actions of several decisions together, pass one history
+per decision and `z_index`, the decision of each action.
 """
 
 import numpy as np
 
 import torch
 from torch import nn
+import torch.nn.functional as F
 
 class LandlordLstmModel(nn.Module):
     def __init__(self):
@@ -19,9 +26,17 @@ class LandlordLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
         lstm_out, (h_n, _) = self.lstm(z)
         lstm_out = lstm_out[:,-1,:]
+        if z_index is not None:
+            # Several decisions in one batch: z has one history per
+            # decision and z_index gives the decision of each row of x
+            lstm_out = lstm_out[z_index]
+        elif lstm_out.shape[0] == 1 and x.shape[0] > 1:
+            # A single history shared by all the legal actions: it is
+            # encoded once and the embedding is broadcast to the batch
+            lstm_out = lstm_out.expand(x.shape[0], -1)
         x = torch.cat([lstm_out,x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -54,9 +69,17 @@ class FarmerLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
         lstm_out, (h_n, _) = self.lstm(z)
         lstm_out = lstm_out[:,-1,:]
+        if z_index is not None:
+            # Several decisions in one batch: z has one history per
+            # decision and z_index gives the decision of each row of x
+            lstm_out = lstm_out[z_index]
+        elif lstm_out.shape[0] == 1 and x.shape[0] > 1:
+            # A single history shared by all the legal actions: it is
+            # encoded once and the embedding is broadcast to the batch
+            lstm_out = lstm_out.expand(x.shape[0], -1)
         x = torch.cat([lstm_out,x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -78,22 +101,173 @@ class FarmerLstmModel(nn.Module):
                 action = torch.argmax(x,dim=0)[0]
             return dict(action=action)
 
+# The last 54 columns of x are the action, the rest are the state
+ACTION_DIM = 54
+
+def _decision_states(z, x, z_index):
+    """
+    The state part of x with one row per history in z. All the
+    actions of a decision share the same state features, so any
+    of their rows will do.
+    """
+    if z_index is None:
+        return x[:z.shape[0], :-ACTION_DIM]
+    rows = torch.zeros(z.shape[0], dtype=torch.long, device=x.device)
+    rows.scatter_(0, z_index, torch.arange(x.shape[0], device=x.device))
+    return x[rows, :-ACTION_DIM]
+
+def _output(values, return_value, flags):
+    if return_value:
+        return dict(values=values)
+    else:
+        if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
+            action = torch.randint(values.shape[0], (1,))[0]
+        else:
+            action = torch.argmax(values,dim=0)[0]
+        return dict(action=action)
+
+class _FactoredDense1:
+    """
+    dense1 of the LSTM models split into its state part (history
+    embedding and state features), computed once per decision, and
+    its action part, computed for every legal action. The weights
+    and the values are the same as the LSTM models'.
+    """
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
+        if not isinstance(self.dense1, nn.Linear):
+            # e.g. a quantized layer, whose weight cannot be split
+            return super().forward(z, x, return_value, flags, z_index)
+        lstm_out, (h_n, _) = self.lstm(z)
+        lstm_out = lstm_out[:,-1,:]
+        state = torch.cat([lstm_out, _decision_states(z, x, z_index)], dim=-1)
+        weight = self.dense1.weight
+        state_part = F.linear(state, weight[:, :-ACTION_DIM], self.dense1.bias)
+        if z_index is not None:
+            state_part = state_part[z_index]
+        x = F.linear(x[:, -ACTION_DIM:], weight[:, -ACTION_DIM:]) + state_part
+        x = torch.relu(x)
+        x = self.dense2(x)
+        x = torch.relu(x)
+        x = self.dense3(x)
+        x = torch.relu(x)
+        x = self.dense4(x)
+        x = torch.relu(x)
+        x = self.dense5(x)
+        x = torch.relu(x)
+        x = self.dense6(x)
+        return _output(x, return_value, flags)
+
+class LandlordFactoredModel(_FactoredDense1, LandlordLstmModel):
+    pass
+
+class FarmerFactoredModel(_FactoredDense1, FarmerLstmModel):
+    pass
+
+class TwoTowerModel(nn.Module):
+    """
+    A fully decomposed scorer: a state tower (history LSTM and
+    state features) run once per decision, an action tower run on
+    the 54-dim action encoding, and a small head on the sum of the
+    two embeddings. It has to be trained; it does not load the
+    LSTM models' checkpoints.
+    """
+    def __init__(self, state_dim):
+        super().__init__()
+        self.lstm = nn.LSTM(162, 128, batch_first=True)
+        self.state1 = nn.Linear(state_dim + 128, 512)
+        self.state2 = nn.Linear(512, 512)
+        self.state3 = nn.Linear(512, 256)
+        self.action1 = nn.Linear(ACTION_DIM, 256)
+        self.action2 = nn.Linear(256, 256)
+        self.head = nn.Linear(256, 1)
+
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
+        lstm_out, (h_n, _) = self.lstm(z)
+        lstm_out = lstm_out[:,-1,:]
+        s = torch.cat([lstm_out, _decision_states(z, x, z_index)], dim=-1)
+        s = torch.relu(self.state1(s))
+        s = torch.relu(self.state2(s))
+        s = self.state3(s)
+        if z_index is not None:
+            s = s[z_index]
+        a = torch.relu(self.action1(x[:, -ACTION_DIM:]))
+        a = self.action2(a)
+        x = self.head(torch.relu(s + a))
+        return _output(x, return_value, flags)
+
+class LandlordTwoTowerModel(TwoTowerModel):
+    def __init__(self):
+        super().__init__(373 - ACTION_DIM)
+
+class FarmerTwoTowerModel(TwoTowerModel):
+    def __init__(self):
+        super().__init__(484 - ACTION_DIM)
+
+class StudentModel(nn.Module):
+    """
+    A small model with the same inputs as the LSTM models, trained
+    to reproduce their values (see douzero/evaluation/distill.py).
+    """
+    def __init__(self, x_dim):
+        super().__init__()
+        self.lstm = nn.LSTM(162, 64, batch_first=True)
+        self.dense1 = nn.Linear(x_dim + 64, 256)
+        self.dense2 = nn.Linear(256, 128)
+        self.dense3 = nn.Linear(128, 1)
+
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
+        lstm_out, (h_n, _) = self.lstm(z)
+        lstm_out = lstm_out[:,-1,:]
+        if z_index is not None:
+            lstm_out = lstm_out[z_index]
+        elif lstm_out.shape[0] == 1 and x.shape[0] > 1:
+            lstm_out = lstm_out.expand(x.shape[0], -1)
+        x = torch.cat([lstm_out,x], dim=-1)
+        x = torch.relu(self.dense1(x))
+        x = torch.relu(self.dense2(x))
+        x = self.dense3(x)
+        return _output(x, return_value, flags)
+
+class LandlordStudentModel(StudentModel):
+    def __init__(self):
+        super().__init__(373)
+
+class FarmerStudentModel(StudentModel):
+    def __init__(self):
+        super().__init__(484)
+
 # Model dict is only used in evaluation but not training
 model_dict = {}
 model_dict['landlord'] = LandlordLstmModel
 model_dict['landlord_up'] = FarmerLstmModel
 model_dict['landlord_down'] = FarmerLstmModel
 
+# The model families, selected with --model_type in training and
+# `model_type` in DeepAgent. `factored` loads the `lstm` checkpoints.
+model_families = {
+    'lstm': model_dict,
+    'factored': {'landlord': LandlordFactoredModel,
+                 'landlord_up': FarmerFactoredModel,
+                 'landlord_down': FarmerFactoredModel},
+    'two_tower': {'landlord': LandlordTwoTowerModel,
+                  'landlord_up': FarmerTwoTowerModel,
+                  'landlord_down': FarmerTwoTowerModel},
+    'student': {'landlord': LandlordStudentModel,
+                'landlord_up': FarmerStudentModel,
+                'landlord_down': FarmerStudentModel},
+}
+
 class Model:
     """
     The wrapper for the three models. We also wrap several
     interfaces such as share_memory, eval, etc.
     """
-    def __init__(self, device=0):
+    def __init__(self, device=0, model_type='lstm'):
+        family = model_families[model_type]
         self.models = {}
-        self.models['landlord'] = LandlordLstmModel().to(torch.device('cuda:'+str(device)))
-        self.models['landlord_up'] = FarmerLstmModel().to(torch.device('cuda:'+str(device)))
-        self.models['landlord_down'] = FarmerLstmModel().to(torch.device('cuda:'+str(device)))
+        self.models['landlord'] = family['landlord']().to(torch.device('cuda:'+str(device)))
+        self.models['landlord_up'] = family['landlord_up']().to(torch.device('cuda:'+str(device)))
+        self.models['landlord_down'] = family['landlord_down']().to(torch.device('cuda:'+str(device)))
 
     def forward(self, position, z, x, training=False, flags=None):
         model = self.models[position]
@@ -2,8 +2,6 @@ import os
 import typing
 import logging
 import traceback
-import numpy as np
-from collections import Counter
 import time
 
 import torch 
@@ -11,15 +9,7 @@ from torch import multiprocessing as mp
 
 from .env_utils import Environment
 from douzero.env import Env
-
-Card2Column = {3: 0, 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7,
-               11: 8, 12: 9, 13: 10, 14: 11, 17: 12}
-
-NumOnes2Array = {0: np.array([0, 0, 0, 0]),
-                 1: np.array([1, 0, 0, 0]),
-                 2: np.array([1, 1, 0, 0]),
-                 3: np.array([1, 1, 1, 0]),
-                 4: np.array([1, 1, 1, 1])}
+from douzero.env.env import action_cache
 
 shandle = logging.StreamHandler()
 shandle.setFormatter(
@@ -133,7 +123,7 @@ def act(i, device, free_queue, full_queue, model, buffers, flags):
                 obs_x_no_action_buf[position].append(env_output['obs_x_no_action'])
                 obs_z_buf[position].append(env_output['obs_z'])
                 with torch.no_grad():
-                    agent_output = model.forward(position, obs['z_batch'], obs['x_batch'], flags=flags)
+                    agent_output = model.forward(position, obs['z_batch'][:1], obs['x_batch'], flags=flags)
                 _action_idx = int(agent_output['action'].cpu().detach().numpy())
                 action = obs['legal_actions'][_action_idx]
                 obs_action_buf[position].append(_cards2tensor(action))
@@ -187,19 +177,4 @@ def _cards2tensor(list_cards):
     representation
     See Figure 2 in https://arxiv.org/pdf/2106.06135.pdf
     """
-    if len(list_cards) == 0:
-        return torch.zeros(54, dtype=torch.int8)
-
-    matrix = np.zeros([4, 13], dtype=np.int8)
-    jokers = np.zeros(2, dtype=np.int8)
-    counter = Counter(list_cards)
-    for card, num_times in counter.items():
-        if card < 20:
-            matrix[:, Card2Column[card]] = NumOnes2Array[num_times]
-        elif card == 20:
-            jokers[0] = 1
-        elif card == 30:
-            jokers[1] = 1
-    matrix = np.concatenate((matrix.flatten('F'), jokers))
-    matrix = torch.from_numpy(matrix)
-    return matrix
+    return torch.from_numpy(action_cache.encode([list_cards])[0])
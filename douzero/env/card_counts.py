@@ -0,0 +1,89 @@
+"""
+Cards as 15-slot rank-count vectors: one slot per rank from 3 to
+2, then the two jokers.
+"""
+
+NumSlots = 15
+Slot2Card = [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 17, 20, 30]
+Card2Slot = {card: slot for slot, card in enumerate(Slot2Card)}
+
+
+class CardCounts(object):
+    """
+    An immutable multiset of cards. Adding or removing cards
+    returns a new instance in time independent of its size, so
+    instances can be shared freely (e.g., by infoset snapshots).
+    `cards`, the sorted list of the cards, is only built when it
+    is first asked for; treat it as read-only.
+    """
+    __slots__ = ('counts', 'total', '_cards')
+
+    def __init__(self, counts=None, total=None):
+        self.counts = counts if counts is not None else [0] * NumSlots
+        self.total = total if total is not None else sum(self.counts)
+        self._cards = None
+
+    @classmethod
+    def from_cards(cls, cards):
+        counts = [0] * NumSlots
+        for card in cards:
+            counts[Card2Slot[card]] += 1
+        return cls(counts, len(cards))
+
+    def add(self, cards):
+        counts = list(self.counts)
+        for card in cards:
+            counts[Card2Slot[card]] += 1
+        return CardCounts(counts, self.total + len(cards))
+
+    def remove(self, cards):
+        """
+        Remove `cards`, which must all be in the multiset, like
+        `list.remove`.
+        """
+        counts = list(self.counts)
+        for card in cards:
+            slot = Card2Slot[card]
+            if counts[slot] == 0:
+                raise ValueError('{} is not in the cards'.format(card))
+            counts[slot] -= 1
+        return CardCounts(counts, self.total - len(cards))
+
+    def remove_lowest(self, num_cards):
+        """
+        Remove the `num_cards` lowest cards, or all of them if there
+        are fewer.
+        """
+        counts = list(self.counts)
+        left = num_cards
+        for slot in range(NumSlots):
+            if left == 0:
+                break
+            taken = min(counts[slot], left)
+            counts[slot] -= taken
+            left -= taken
+        return CardCounts(counts, self.total - (num_cards - left))
+
+    def __len__(self):
+        return self.total
+
+    @property
+    def cards(self):
+        if self._cards is None:
+            cards = []
+            for card, count in zip(Slot2Card, self.counts):
+                if count:
+                    cards.extend([card] * count)
+            self._cards = cards
+        return self._cards
+
+    def __getstate__(self):
+        return self.counts, self.total
+
+    def __setstate__(self, state):
+        self.counts, self.total = state
+        self._cards = None
+
+
+# The whole deck: four of each rank and the two jokers
+FullDeck = CardCounts([4] * 13 + [1, 1])
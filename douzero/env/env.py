@@ -1,7 +1,10 @@
-from collections import Counter
+import threading
+
 import numpy as np
 
 from douzero.env.game import GameEnv
+from douzero.env import card_counts
+from douzero.env.card_counts import NumSlots
 
 Card2Column = {3: 0, 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7,
                11: 8, 12: 9, 13: 10, 14: 11, 17: 12}
@@ -12,6 +15,18 @@ NumOnes2Array = {0: np.array([0, 0, 0, 0]),
                  3: np.array([1, 1, 1, 0]),
                  4: np.array([1, 1, 1, 1])}
 
+# The 15-slot rank-count vector of card_counts.py: Card2Column for
+# 3..2, then the two jokers. Card2Slot maps a card value to its slot,
+# and other values to -1.
+Card2Slot = np.full(31, -1, dtype=np.int64)
+for card, slot in card_counts.Card2Slot.items():
+    Card2Slot[card] = slot
+
+# The 4 bits of every (slot, count). A joker slot sets only the first
+# bit, which `_Slot2Columns` keeps as the 53rd and 54th columns.
+_Count2Bits = np.array([NumOnes2Array[n] for n in range(5)], dtype=np.int8)
+_Slot2Columns = np.concatenate((np.arange(52), [52, 56]))
+
 deck = []
 for i in range(3, 15):
     deck.extend([i for _ in range(4)])
@@ -181,7 +196,7 @@ class DummyAgent(object):
         """
         self.action = action
 
-def get_obs(infoset):
+def get_obs(infoset, history=None, buffer=None):
     """
     This function obtains observations with imperfect information
     from the infoset. It has three branches since we encode
@@ -197,6 +212,7 @@ def get_obs(infoset):
     It also encodes the action feature
 
     `z_batch` is a batch of features with hisorical moves only.
+    It is a read-only view that repeats one row.
 
     `legal_actions` is the legal moves
 
@@ -204,15 +220,23 @@ def get_obs(infoset):
     the action features). It does not have the batch dim.
 
     `z`: same as z_batch but not a batch.
+
+    `history` is an optional `HistoryEncoder` kept for the whole
+    game. With it, only the moves played since the previous call
+    are encoded. The observations are the same either way.
+
+    `buffer` is an optional `ObsBuffer` that `x_batch` is written
+    into, instead of a new array.
     """
     if infoset.player_position == 'landlord':
-        return _get_obs_landlord(infoset)
+        features = _landlord_features(infoset)
     elif infoset.player_position == 'landlord_up':
-        return _get_obs_landlord_up(infoset)
+        features = _farmer_features(infoset, 'landlord_down')
     elif infoset.player_position == 'landlord_down':
-        return _get_obs_landlord_down(infoset)
+        features = _farmer_features(infoset, 'landlord_up')
     else:
         raise ValueError('')
+    return _build_obs(infoset.player_position, infoset, features, history, buffer)
 
 def _get_one_hot_array(num_left_cards, max_num_cards):
     """
@@ -223,6 +247,32 @@ def _get_one_hot_array(num_left_cards, max_num_cards):
 
     return one_hot
 
+def _card_slots(cards):
+    """
+    The slot of every card in a list. An invalid card value raises
+    KeyError, as the Card2Column lookup did.
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    outside = (cards < 0) | (cards >= len(Card2Slot))
+    slots = Card2Slot[np.where(outside, 0, cards)]
+    if (slots < 0).any():
+        raise KeyError(int(cards[slots < 0][0]))
+    return slots
+
+def _cards2counts(list_cards):
+    """
+    The 15-slot rank-count vector of a list of cards.
+    """
+    return np.bincount(_card_slots(list_cards), minlength=NumSlots)
+
+def _counts2array(counts):
+    """
+    The 54-dim card encoding of a count vector, or of a batch of
+    them, looked up from `_Count2Bits`.
+    """
+    bits = _Count2Bits[np.minimum(counts, 4)]
+    return bits.reshape(bits.shape[:-2] + (NumSlots * 4,))[..., _Slot2Columns]
+
 def _cards2array(list_cards):
     """
     A utility function that transforms the actions, i.e.,
@@ -232,18 +282,78 @@ def _cards2array(list_cards):
     """
     if len(list_cards) == 0:
         return np.zeros(54, dtype=np.int8)
+    return _counts2array(_cards2counts(list_cards))
 
-    matrix = np.zeros([4, 13], dtype=np.int8)
-    jokers = np.zeros(2, dtype=np.int8)
-    counter = Counter(list_cards)
-    for card, num_times in counter.items():
-        if card < 20:
-            matrix[:, Card2Column[card]] = NumOnes2Array[num_times]
-        elif card == 20:
-            jokers[0] = 1
-        elif card == 30:
-            jokers[1] = 1
-    return np.concatenate((matrix.flatten('F'), jokers))
+def _actions2array(actions):
+    """
+    `_cards2array` of every action in a list, as one (N, 54) array.
+    """
+    lengths = [len(action) for action in actions]
+    cards = [card for action in actions for card in action]
+    rows = np.repeat(np.arange(len(actions)), lengths)
+    counts = np.bincount(rows * NumSlots + _card_slots(cards), minlength=len(actions) * NumSlots)
+    return _counts2array(counts.reshape(len(actions), NumSlots))
+
+class ActionEncodingCache(object):
+    """
+    The 54-dim encodings of the moves seen so far, keyed by the
+    move as a tuple. The same moves come up in decision after
+    decision, so most of them are encoded once per process and then
+    gathered from `table`.
+
+    There are 27472 distinct Doudizhu moves, so the default
+    `max_size` holds all of them. If it fills up anyway (e.g.,
+    unsorted moves from the screen), the cache is emptied and
+    starts over.
+    """
+    def __init__(self, max_size=1 << 15):
+        self.max_size = max_size
+        self.table = np.zeros((max_size, 54), dtype=np.int8)
+        self.index = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def encode(self, actions):
+        """
+        The (N, 54) int8 encodings of a list of moves.
+        """
+        keys = [tuple(action) for action in actions]
+        with self._lock:
+            rows = self._rows(keys)
+            if rows is None:
+                self.index.clear()
+                rows = self._rows(keys)
+            return self.table[rows]
+
+    def _rows(self, keys):
+        index = self.index
+        rows = [index.get(key, -1) for key in keys]
+        missing = [key for key, row in zip(keys, rows) if row < 0]
+        if missing:
+            new_keys = list(dict.fromkeys(missing))
+            size = len(index)
+            if size + len(new_keys) > self.max_size:
+                return None
+            self.table[size:size + len(new_keys)] = _actions2array(new_keys)
+            for row, key in enumerate(new_keys, size):
+                index[key] = row
+            rows = [index[key] for key in keys]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return rows
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.index), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+# Shared by everything that encodes moves in this process
+action_cache = ActionEncodingCache()
 
 def _action_seq_list2array(action_seq_list):
     """
@@ -255,9 +365,7 @@ def _action_seq_list2array(action_seq_list):
     Finally, we obtain a 5x162 matrix, which will be fed
     into LSTM for encoding.
     """
-    action_seq_array = np.zeros((len(action_seq_list), 54))
-    for row, list_cards in enumerate(action_seq_list):
-        action_seq_array[row, :] = _cards2array(list_cards)
+    action_seq_array = action_cache.encode(action_seq_list).astype(np.float64)
     action_seq_array = action_seq_array.reshape(5, 162)
     return action_seq_array
 
@@ -274,6 +382,48 @@ def _process_action_seq(sequence, length=15):
         sequence = empty_sequence
     return sequence
 
+class HistoryEncoder(object):
+    """
+    Incremental version of
+    `_action_seq_list2array(_process_action_seq(sequence))` for
+    one game. The last 15 encoded moves are kept in a rolling
+    buffer, so each move is encoded only once, when it first shows
+    up in the history. If a sequence does not continue the
+    previous one (e.g., a new game), the buffer is rebuilt.
+
+    The LSTM state cannot be carried over between turns: the window
+    is regrouped into 5 steps of 3 moves from its end, so every step
+    changes when a move is appended.
+    """
+    def __init__(self, length=15):
+        self.length = length
+        self.moves = []
+        self.buffer = np.zeros((length, 54))
+
+    def encode(self, sequence):
+        num_moves = len(self.moves)
+        if len(sequence) < num_moves or sequence[:num_moves] != self.moves:
+            num_moves = 0
+            self.buffer[:] = 0
+        new_moves = sequence[num_moves:]
+        if len(new_moves) >= self.length:
+            self.buffer[:] = 0
+            new_moves = new_moves[-self.length:]
+        elif len(new_moves) > 0:
+            self.buffer[:-len(new_moves)] = self.buffer[len(new_moves):]
+        if len(new_moves) > 0:
+            self.buffer[-len(new_moves):] = action_cache.encode(new_moves)
+        self.moves = list(sequence)
+        return self.buffer.reshape(self.length // 3, 162).copy()
+
+def _history2array(sequence, history=None):
+    """
+    Encode the historical moves, with `history` if one is given.
+    """
+    if history is None:
+        return _action_seq_list2array(_process_action_seq(sequence))
+    return history.encode(sequence)
+
 def _get_one_hot_bomb(bomb_num):
     """
     A utility function to encode the number of bombs
@@ -283,286 +433,78 @@ def _get_one_hot_bomb(bomb_num):
     one_hot[bomb_num] = 1
     return one_hot
 
-def _get_obs_landlord(infoset):
+def _landlord_features(infoset):
     """
-    Obttain the landlord features. See Table 4 in
+    The landlord features, without the action. See Table 4 in
     https://arxiv.org/pdf/2106.06135.pdf
     """
-    num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
-    my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
-                                   num_legal_actions, axis=0)
-
-    other_handcards = _cards2array(infoset.other_hand_cards)
-    other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
-                                      num_legal_actions, axis=0)
-
-    last_action = _cards2array(infoset.last_move)
-    last_action_batch = np.repeat(last_action[np.newaxis, :],
-                                  num_legal_actions, axis=0)
-
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
-
-    landlord_up_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord_up'], 17)
-    landlord_up_num_cards_left_batch = np.repeat(
-        landlord_up_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_down_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord_down'], 17)
-    landlord_down_num_cards_left_batch = np.repeat(
-        landlord_down_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_up_played_cards = _cards2array(
-        infoset.played_cards['landlord_up'])
-    landlord_up_played_cards_batch = np.repeat(
-        landlord_up_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_down_played_cards = _cards2array(
-        infoset.played_cards['landlord_down'])
-    landlord_down_played_cards_batch = np.repeat(
-        landlord_down_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    bomb_num = _get_one_hot_bomb(
-        infoset.bomb_num)
-    bomb_num_batch = np.repeat(
-        bomb_num[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    x_batch = np.hstack((my_handcards_batch,
-                         other_handcards_batch,
-                         last_action_batch,
-                         landlord_up_played_cards_batch,
-                         landlord_down_played_cards_batch,
-                         landlord_up_num_cards_left_batch,
-                         landlord_down_num_cards_left_batch,
-                         bomb_num_batch,
-                         my_action_batch))
-    x_no_action = np.hstack((my_handcards,
-                             other_handcards,
-                             last_action,
-                             landlord_up_played_cards,
-                             landlord_down_played_cards,
-                             landlord_up_num_cards_left,
-                             landlord_down_num_cards_left,
-                             bomb_num))
-    z = _action_seq_list2array(_process_action_seq(
-        infoset.card_play_action_seq))
-    z_batch = np.repeat(
-        z[np.newaxis, :, :],
-        num_legal_actions, axis=0)
-    obs = {
-            'position': 'landlord',
-            'x_batch': x_batch.astype(np.float32),
-            'z_batch': z_batch.astype(np.float32),
-            'legal_actions': infoset.legal_actions,
-            'x_no_action': x_no_action.astype(np.int8),
-            'z': z.astype(np.int8),
-          }
-    return obs
-
-def _get_obs_landlord_up(infoset):
+    return [_counts2array(infoset.player_hand_counts.counts),
+            _counts2array(infoset.other_hand_counts.counts),
+            _cards2array(infoset.last_move),
+            _counts2array(infoset.played_counts['landlord_up'].counts),
+            _counts2array(infoset.played_counts['landlord_down'].counts),
+            _get_one_hot_array(infoset.num_cards_left_dict['landlord_up'], 17),
+            _get_one_hot_array(infoset.num_cards_left_dict['landlord_down'], 17),
+            _get_one_hot_bomb(infoset.bomb_num)]
+
+def _farmer_features(infoset, teammate):
     """
-    Obttain the landlord_up features. See Table 5 in
-    https://arxiv.org/pdf/2106.06135.pdf
+    The landlord_up and landlord_down features, without the
+    action. See Table 5 in https://arxiv.org/pdf/2106.06135.pdf
     """
-    num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
-    my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
-                                   num_legal_actions, axis=0)
-
-    other_handcards = _cards2array(infoset.other_hand_cards)
-    other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
-                                      num_legal_actions, axis=0)
-
-    last_action = _cards2array(infoset.last_move)
-    last_action_batch = np.repeat(last_action[np.newaxis, :],
-                                  num_legal_actions, axis=0)
-
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
-
-    last_landlord_action = _cards2array(
-        infoset.last_move_dict['landlord'])
-    last_landlord_action_batch = np.repeat(
-        last_landlord_action[np.newaxis, :],
-        num_legal_actions, axis=0)
-    landlord_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord'], 20)
-    landlord_num_cards_left_batch = np.repeat(
-        landlord_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
-    landlord_played_cards_batch = np.repeat(
-        landlord_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    last_teammate_action = _cards2array(
-        infoset.last_move_dict['landlord_down'])
-    last_teammate_action_batch = np.repeat(
-        last_teammate_action[np.newaxis, :],
-        num_legal_actions, axis=0)
-    teammate_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord_down'], 17)
-    teammate_num_cards_left_batch = np.repeat(
-        teammate_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    teammate_played_cards = _cards2array(
-        infoset.played_cards['landlord_down'])
-    teammate_played_cards_batch = np.repeat(
-        teammate_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    bomb_num = _get_one_hot_bomb(
-        infoset.bomb_num)
-    bomb_num_batch = np.repeat(
-        bomb_num[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    x_batch = np.hstack((my_handcards_batch,
-                         other_handcards_batch,
-                         landlord_played_cards_batch,
-                         teammate_played_cards_batch,
-                         last_action_batch,
-                         last_landlord_action_batch,
-                         last_teammate_action_batch,
-                         landlord_num_cards_left_batch,
-                         teammate_num_cards_left_batch,
-                         bomb_num_batch,
-                         my_action_batch))
-    x_no_action = np.hstack((my_handcards,
-                             other_handcards,
-                             landlord_played_cards,
-                             teammate_played_cards,
-                             last_action,
-                             last_landlord_action,
-                             last_teammate_action,
-                             landlord_num_cards_left,
-                             teammate_num_cards_left,
-                             bomb_num))
-    z = _action_seq_list2array(_process_action_seq(
-        infoset.card_play_action_seq))
-    z_batch = np.repeat(
-        z[np.newaxis, :, :],
-        num_legal_actions, axis=0)
-    obs = {
-            'position': 'landlord_up',
-            'x_batch': x_batch.astype(np.float32),
-            'z_batch': z_batch.astype(np.float32),
-            'legal_actions': infoset.legal_actions,
-            'x_no_action': x_no_action.astype(np.int8),
-            'z': z.astype(np.int8),
-          }
-    return obs
-
-def _get_obs_landlord_down(infoset):
+    return [_counts2array(infoset.player_hand_counts.counts),
+            _counts2array(infoset.other_hand_counts.counts),
+            _counts2array(infoset.played_counts['landlord'].counts),
+            _counts2array(infoset.played_counts[teammate].counts),
+            _cards2array(infoset.last_move),
+            _cards2array(infoset.last_move_dict['landlord']),
+            _cards2array(infoset.last_move_dict[teammate]),
+            _get_one_hot_array(infoset.num_cards_left_dict['landlord'], 20),
+            _get_one_hot_array(infoset.num_cards_left_dict[teammate], 17),
+            _get_one_hot_bomb(infoset.bomb_num)]
+
+class ObsBuffer(object):
     """
-    Obttain the landlord_down features. See Table 5 in
-    https://arxiv.org/pdf/2106.06135.pdf
+    A float32 buffer for `x_batch` that is reused between calls
+    to `get_obs`. The `x_batch` it returns is a view of the buffer
+    and is only valid until the next call.
+    """
+    def __init__(self):
+        self.array = np.zeros((0, 0), dtype=np.float32)
+
+    def get(self, rows, columns):
+        if self.array.shape[0] < rows or self.array.shape[1] != columns:
+            capacity = rows
+            if self.array.shape[1] == columns:
+                capacity = max(rows, 2 * self.array.shape[0])
+            self.array = np.empty((capacity, columns), dtype=np.float32)
+        return self.array[:rows]
+
+def _build_obs(position, infoset, features, history=None, buffer=None):
     """
+    Write the state features once into x_batch, broadcast to every
+    row, and the encoding of each legal action into the last 54
+    columns.
+    """
+    x_no_action = np.concatenate(features)
     num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
-    my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
-                                   num_legal_actions, axis=0)
-
-    other_handcards = _cards2array(infoset.other_hand_cards)
-    other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
-                                      num_legal_actions, axis=0)
-
-    last_action = _cards2array(infoset.last_move)
-    last_action_batch = np.repeat(last_action[np.newaxis, :],
-                                  num_legal_actions, axis=0)
-
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
-
-    last_landlord_action = _cards2array(
-        infoset.last_move_dict['landlord'])
-    last_landlord_action_batch = np.repeat(
-        last_landlord_action[np.newaxis, :],
-        num_legal_actions, axis=0)
-    landlord_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord'], 20)
-    landlord_num_cards_left_batch = np.repeat(
-        landlord_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
-    landlord_played_cards_batch = np.repeat(
-        landlord_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    last_teammate_action = _cards2array(
-        infoset.last_move_dict['landlord_up'])
-    last_teammate_action_batch = np.repeat(
-        last_teammate_action[np.newaxis, :],
-        num_legal_actions, axis=0)
-    teammate_num_cards_left = _get_one_hot_array(
-        infoset.num_cards_left_dict['landlord_up'], 17)
-    teammate_num_cards_left_batch = np.repeat(
-        teammate_num_cards_left[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    teammate_played_cards = _cards2array(
-        infoset.played_cards['landlord_up'])
-    teammate_played_cards_batch = np.repeat(
-        teammate_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
-    landlord_played_cards_batch = np.repeat(
-        landlord_played_cards[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    bomb_num = _get_one_hot_bomb(
-        infoset.bomb_num)
-    bomb_num_batch = np.repeat(
-        bomb_num[np.newaxis, :],
-        num_legal_actions, axis=0)
-
-    x_batch = np.hstack((my_handcards_batch,
-                         other_handcards_batch,
-                         landlord_played_cards_batch,
-                         teammate_played_cards_batch,
-                         last_action_batch,
-                         last_landlord_action_batch,
-                         last_teammate_action_batch,
-                         landlord_num_cards_left_batch,
-                         teammate_num_cards_left_batch,
-                         bomb_num_batch,
-                         my_action_batch))
-    x_no_action = np.hstack((my_handcards,
-                             other_handcards,
-                             landlord_played_cards,
-                             teammate_played_cards,
-                             last_action,
-                             last_landlord_action,
-                             last_teammate_action,
-                             landlord_num_cards_left,
-                             teammate_num_cards_left,
-                             bomb_num))
-    z = _action_seq_list2array(_process_action_seq(
-        infoset.card_play_action_seq))
-    z_batch = np.repeat(
-        z[np.newaxis, :, :],
-        num_legal_actions, axis=0)
+    num_columns = len(x_no_action) + 54
+    if buffer is None:
+        x_batch = np.empty((num_legal_actions, num_columns), dtype=np.float32)
+    else:
+        x_batch = buffer.get(num_legal_actions, num_columns)
+    x_batch[:, :-54] = x_no_action
+    x_batch[:, -54:] = action_cache.encode(infoset.legal_actions)
+
+    z = _history2array(infoset.card_play_action_seq, history)
+    # Every row has the same history, so z_batch is a read-only view
+    # of one row; consumers take z_batch[:1]
+    z_batch = np.broadcast_to(z[np.newaxis, :, :].astype(np.float32),
+                              (num_legal_actions,) + z.shape)
     obs = {
-            'position': 'landlord_down',
-            'x_batch': x_batch.astype(np.float32),
-            'z_batch': z_batch.astype(np.float32),
+            'position': position,
+            'x_batch': x_batch,
+            'z_batch': z_batch,
             'legal_actions': infoset.legal_actions,
             'x_no_action': x_no_action.astype(np.int8),
             'z': z.astype(np.int8),
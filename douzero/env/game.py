@@ -1,6 +1,8 @@
-from copy import deepcopy
+import copy
 from . import move_detector as md, move_selector as ms
 from .move_generator import MovesGener
+from .card_counts import CardCounts, FullDeck, NumSlots
+from douzero.timing import timers
 
 EnvCard2RealCard = {3: '3', 4: '4', 5: '5', 6: '6', 7: '7',
                     8: '8', 9: '9', 10: 'T', 11: 'J', 12: 'Q',
@@ -38,9 +40,9 @@ class GameEnv(object):
                                'landlord_up': [],
                                'landlord_down': []}
 
-        self.played_cards = {'landlord': [],
-                             'landlord_up': [],
-                             'landlord_down': []}
+        self.played_counts = {'landlord': CardCounts(),
+                              'landlord_up': CardCounts(),
+                              'landlord_down': CardCounts()}
 
         self.last_move = []
         self.last_two_moves = []
@@ -70,10 +72,15 @@ class GameEnv(object):
         self.get_acting_player_position()
         self.game_infoset = self.get_infoset()
 
+    @property
+    def played_cards(self):
+        # 出过的牌以计数向量保存，需要列表时再生成(按大小排序，而不是出牌顺序)
+        return {pos: counts.cards for pos, counts in self.played_counts.items()}
+
     def game_done(self):
-        if len(self.info_sets['landlord'].player_hand_cards) == 0 or \
-                len(self.info_sets['landlord_up'].player_hand_cards) == 0 or \
-                len(self.info_sets['landlord_down'].player_hand_cards) == 0:
+        if self.info_sets['landlord'].player_hand_counts.total == 0 or \
+                self.info_sets['landlord_up'].player_hand_counts.total == 0 or \
+                self.info_sets['landlord_down'].player_hand_counts.total == 0:
             # if one of the three players discards his hand,
             # then game is over.
             self.compute_player_utility()
@@ -83,7 +90,7 @@ class GameEnv(object):
 
     def compute_player_utility(self):
 
-        if len(self.info_sets['landlord'].player_hand_cards) == 0:
+        if self.info_sets['landlord'].player_hand_counts.total == 0:
             self.player_utility_dict = {'landlord': 2,
                                         'farmer': -1}
         else:
@@ -148,17 +155,21 @@ class GameEnv(object):
         self.card_play_action_seq.append(action)
         self.update_acting_player_hand_cards(action)
 
-        self.played_cards[self.acting_player_position] += action
+        # 出过的牌、底牌和手牌可能被之前的 infoset 快照共享，所以都换成新的对象而不是原地修改
+        self.played_counts[self.acting_player_position] = \
+            self.played_counts[self.acting_player_position].add(action)
 
         if self.acting_player_position == 'landlord' and \
                 len(action) > 0 and \
                 len(self.three_landlord_cards) > 0:
+            three_landlord_cards = list(self.three_landlord_cards)
             for card in action:
-                if len(self.three_landlord_cards) > 0:
-                    if card in self.three_landlord_cards:
-                        self.three_landlord_cards.remove(card)
+                if len(three_landlord_cards) > 0:
+                    if card in three_landlord_cards:
+                        three_landlord_cards.remove(card)
                 else:
                     break
+            self.three_landlord_cards = three_landlord_cards
         self.game_done()
         if not self.game_over:
             self.get_acting_player_position()
@@ -204,15 +215,15 @@ class GameEnv(object):
     # 更新手牌
     def update_acting_player_hand_cards(self, action):
         if action != []:
+            info_set = self.info_sets[self.acting_player_position]
             # 更新玩家手牌，删除对应的牌
             if self.acting_player_position == self.players[0]:
-                for card in action:
-                    self.info_sets[self.acting_player_position].player_hand_cards.remove(card)
-            # 更新另外两个玩家手牌，删除相同数量的牌
+                info_set.player_hand_counts = info_set.player_hand_counts.remove(action)
+            # 更新另外两个玩家手牌，删除相同数量的牌(最小的几张)
             else:
-                del self.info_sets[self.acting_player_position].player_hand_cards[0:len(action)]
-            self.info_sets[self.acting_player_position].player_hand_cards.sort()
+                info_set.player_hand_counts = info_set.player_hand_counts.remove_lowest(len(action))
 
+    @timers.wrap('legal_actions')
     def get_legal_card_play_actions(self):
         mg = MovesGener(
             self.info_sets[self.acting_player_position].player_hand_cards)
@@ -314,9 +325,9 @@ class GameEnv(object):
                                'landlord_up': [],
                                'landlord_down': []}
 
-        self.played_cards = {'landlord': [],
-                             'landlord_up': [],
-                             'landlord_down': []}
+        self.played_counts = {'landlord': CardCounts(),
+                              'landlord_up': CardCounts(),
+                              'landlord_down': CardCounts()}
 
         self.last_move = []
         self.last_two_moves = []
@@ -328,6 +339,7 @@ class GameEnv(object):
         self.bomb_num = 0
         self.last_pid = 'landlord'
 
+    @timers.wrap('get_infoset')
     def get_infoset(self):
         self.info_sets[
             self.acting_player_position].last_pid = self.last_pid
@@ -349,11 +361,9 @@ class GameEnv(object):
             self.acting_player_position].last_move_dict = self.last_move_dict
 
         self.info_sets[self.acting_player_position].num_cards_left_dict = \
-            {pos: len(self.info_sets[pos].player_hand_cards)
+            {pos: self.info_sets[pos].player_hand_counts.total
              for pos in ['landlord', 'landlord_up', 'landlord_down']}
 
-        self.info_sets[self.acting_player_position].other_hand_cards = []
-
         '''
         调整计算其他人手牌的方法，整副牌减去玩家手牌与出过的牌
         for pos in ['landlord', 'landlord_up', 'landlord_down']:
@@ -362,30 +372,26 @@ class GameEnv(object):
                     self.acting_player_position].other_hand_cards += \
                     self.info_sets[pos].player_hand_cards
         '''
-        # 把出过的牌中三个子列表合成一个列表
-        played_cards_tmp = []
-        for i in list(self.played_cards.values()):
-            played_cards_tmp.extend(i)
-        # 出过的牌和玩家手上的牌
-        played_and_hand_cards = played_cards_tmp + self.info_sets[self.acting_player_position].player_hand_cards
-        # 整副牌减去出过的牌和玩家手上的牌，就是其他人的手牌
-        for i in set(AllEnvCard):
-            self.info_sets[
-                self.acting_player_position].other_hand_cards.extend([i] * (AllEnvCard.count(i) - played_and_hand_cards.count(i)))
-
-        self.info_sets[self.acting_player_position].played_cards = \
-            self.played_cards
+        # 整副牌减去出过的牌和玩家手上的牌，就是其他人的手牌(按计数向量逐个点数相减)
+        hand_counts = self.info_sets[self.acting_player_position].player_hand_counts.counts
+        played = [counts.counts for counts in self.played_counts.values()]
+        self.info_sets[self.acting_player_position].other_hand_counts = CardCounts(
+            [max(FullDeck.counts[i] - hand_counts[i] - played[0][i] - played[1][i] - played[2][i], 0)
+             for i in range(NumSlots)])
+
+        self.info_sets[self.acting_player_position].played_counts = \
+            self.played_counts
         self.info_sets[self.acting_player_position].three_landlord_cards = \
             self.three_landlord_cards
         self.info_sets[self.acting_player_position].card_play_action_seq = \
             self.card_play_action_seq
 
         self.info_sets[
-            self.acting_player_position].all_handcards = \
-            {pos: self.info_sets[pos].player_hand_cards
+            self.acting_player_position].all_hand_counts = \
+            {pos: self.info_sets[pos].player_hand_counts
              for pos in ['landlord', 'landlord_up', 'landlord_down']}
 
-        return deepcopy(self.info_sets[self.acting_player_position])
+        return self.info_sets[self.acting_player_position].snapshot()
 
 class InfoSet(object):
     """
@@ -397,16 +403,18 @@ class InfoSet(object):
     def __init__(self, player_position):
         # The player position, i.e., landlord, landlord_down, or landlord_up
         self.player_position = player_position
-        # The hand cands of the current player. A list.
-        self.player_hand_cards = None
+        # The hand cands of the current player, as CardCounts.
+        # `player_hand_cards` is the sorted list of them.
+        self.player_hand_counts = None
         # The number of cards left for each player. It is a dict with str-->int 
         self.num_cards_left_dict = None
         # The three landload cards. A list.
         self.three_landlord_cards = None
         # The historical moves. It is a list of list
         self.card_play_action_seq = None
-        # The union of the hand cards of the other two players for the current player 
-        self.other_hand_cards = None
+        # The union of the hand cards of the other two players for the current player,
+        # as CardCounts. `other_hand_cards` is the sorted list of them.
+        self.other_hand_counts = None
         # The legal actions for the current move. It is a list of list
         self.legal_actions = None
         # The most recent valid move
@@ -415,11 +423,79 @@ class InfoSet(object):
         self.last_two_moves = None
         # The last moves for all the postions
         self.last_move_dict = None
-        # The played cands so far. It is a list.
-        self.played_cards = None
-        # The hand cards of all the players. It is a dict. 
-        self.all_handcards = None
+        # The played cands so far of every position, as CardCounts.
+        # `played_cards` is a dict of sorted lists.
+        self.played_counts = None
+        # The hand cards of all the players, as CardCounts. `all_handcards`
+        # is a dict of sorted lists.
+        self.all_hand_counts = None
         # Last player position that plays a valid move, i.e., not `pass`
         self.last_pid = None
         # The number of bombs played so far
         self.bomb_num = None
+
+    def snapshot(self):
+        """
+        A copy of the infoset that later steps do not change. The
+        game replaces the hands, the played cards and the landlord
+        cards instead of modifying them, and never modifies a move,
+        so these are shared with the snapshot. Only the containers
+        the game appends or assigns to are copied. Agents must
+        treat the snapshot as read-only.
+        """
+        infoset = copy.copy(self)
+        infoset.card_play_action_seq = list(self.card_play_action_seq)
+        infoset.last_move_dict = dict(self.last_move_dict)
+        infoset.played_counts = dict(self.played_counts)
+        return infoset
+
+    # List views of the card counts, built when they are first used.
+    # They are shared, so do not modify them.
+
+    @property
+    def player_hand_cards(self):
+        return _cards(self.player_hand_counts)
+
+    @player_hand_cards.setter
+    def player_hand_cards(self, cards):
+        self.player_hand_counts = _counts(cards)
+
+    @property
+    def other_hand_cards(self):
+        return _cards(self.other_hand_counts)
+
+    @other_hand_cards.setter
+    def other_hand_cards(self, cards):
+        self.other_hand_counts = _counts(cards)
+
+    @property
+    def played_cards(self):
+        return _cards_dict(self.played_counts)
+
+    @played_cards.setter
+    def played_cards(self, cards_dict):
+        self.played_counts = _counts_dict(cards_dict)
+
+    @property
+    def all_handcards(self):
+        return _cards_dict(self.all_hand_counts)
+
+    @all_handcards.setter
+    def all_handcards(self, cards_dict):
+        self.all_hand_counts = _counts_dict(cards_dict)
+
+def _cards(counts):
+    return None if counts is None else counts.cards
+
+def _counts(cards):
+    return None if cards is None else CardCounts.from_cards(cards)
+
+def _cards_dict(counts_dict):
+    if counts_dict is None:
+        return None
+    return {pos: counts.cards for pos, counts in counts_dict.items()}
+
+def _counts_dict(cards_dict):
+    if cards_dict is None:
+        return None
+    return {pos: CardCounts.from_cards(cards) for pos, cards in cards_dict.items()}
@@ -0,0 +1,165 @@
+"""
+Batched inference across concurrent games.
+
+Every `DeepAgent.act` runs one small forward pass. When many games
+are played at once (e.g., one per thread), `BatchedInference` collects
+the pending decisions of each position and scores all their actions
+in one forward pass. It then hands every game its own values.
+
+    service = BatchedInference(model_path_dict, max_batch=2048, max_wait=0.002)
+    agents = {p: BatchedAgent(p, service) for p in model_path_dict}
+    ...  # play games in many threads with `agents`
+    service.close()
+
+A batch is run as soon as it holds `max_batch` actions, or `max_wait`
+seconds after its first request arrived. Each worker process runs its
+own service; with a .dzmm checkpoint they still share the weights.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.model_registry import registry
+
+
+class _Request(object):
+
+    def __init__(self, z, x):
+        self.z = z
+        self.x = x
+        self.values = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchedInference(object):
+    """
+    One worker thread per position model. `backend` is eager or int8;
+    the frozen backend is traced for a single history and cannot
+    score several decisions at once.
+    """
+    def __init__(self, model_path_dict, backend='eager', max_batch=2048, max_wait=0.002, model_type='lstm'):
+        if backend not in ('eager', 'int8'):
+            raise ValueError('Batched inference does not support the {} backend'.format(backend))
+        self.backend = backend
+        self.model_type = model_type
+        self.use_cuda = torch.cuda.is_available() and backend == 'eager'
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.models = {p: registry.get(p, path, backend, model_type) for p, path in model_path_dict.items()}
+        self.num_batches = 0
+        self.num_requests = 0
+        self.num_actions = 0
+        self._queues = {p: queue.Queue() for p in self.models}
+        self._stopped = False
+        # Keeps a request from being queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._threads = []
+        for position in self.models:
+            thread = threading.Thread(target=self._serve, args=(position,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def predict(self, position, z, x_batch):
+        """
+        Blocking: the values of the actions in `x_batch` given the
+        history `z` (a batch of size 1), computed in a shared batch.
+        """
+        request = _Request(z, x_batch)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('The inference service is closed')
+            self._queues[position].put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.values
+
+    def close(self):
+        # Requests queued before the sentinel are still served
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            for q in self._queues.values():
+                q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        return {'batches': self.num_batches,
+                'requests_per_batch': self.num_requests / max(self.num_batches, 1),
+                'actions_per_batch': self.num_actions / max(self.num_batches, 1)}
+
+    def _collect(self, q, first):
+        # Wait for more requests until the batch is full or max_wait has passed
+        batch = [first]
+        num_actions = len(first.x)
+        deadline = time.perf_counter() + self.max_wait
+        while num_actions < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = q.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                q.put(None)  # let the outer loop stop after this batch
+                break
+            batch.append(request)
+            num_actions += len(request.x)
+        return batch
+
+    def _serve(self, position):
+        model = self.models[position]
+        q = self._queues[position]
+        while True:
+            first = q.get()
+            if first is None:
+                return
+            batch = self._collect(q, first)
+            try:
+                sizes = [len(r.x) for r in batch]
+                z = torch.cat([r.z for r in batch])
+                x = torch.cat([r.x for r in batch])
+                z_index = torch.from_numpy(np.repeat(np.arange(len(batch)), sizes))
+                if self.use_cuda:
+                    z_index = z_index.cuda()
+                with torch.no_grad():
+                    values = model.forward(z, x, return_value=True, z_index=z_index)['values']
+                for request, v in zip(batch, torch.split(values, sizes)):
+                    request.values = v
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            self.num_actions += sum(sizes)
+            for request in batch:
+                request.done.set()
+
+
+class BatchedAgent(DeepAgent):
+    """
+    A `DeepAgent` whose forward passes go through a shared
+    `BatchedInference` service. Like `DeepAgent`, it keeps a history
+    encoder per thread; one agent per game and position lets each
+    encoder follow a single game.
+    """
+    def __init__(self, position, service, kicker_top_n=None):
+        self.position = position
+        self.backend = service.backend
+        self.model_type = service.model_type
+        self.kicker_top_n = kicker_top_n
+        self.use_cuda = service.use_cuda
+        self.model = service.models[position]
+        self._local = threading.local()
+        self.service = service
+
+    def predict(self, z, x_batch):
+        return self.service.predict(self.position, z, x_batch)
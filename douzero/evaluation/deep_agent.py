@@ -1,44 +1,218 @@
+import copy
+import inspect
+import threading
+import warnings
+
 import torch
 import numpy as np
 
-from douzero.env.env import get_obs
+from douzero.env.env import get_obs, HistoryEncoder, ObsBuffer
+from douzero.evaluation import mmap_checkpoint
+from douzero.evaluation.kicker_pruning import prune_kickers
+from douzero.evaluation.model_registry import registry
+from douzero.timing import timers
 
-def _load_model(position, model_path):
-    from douzero.dmc.models import model_dict
-    model = model_dict[position]()
-    model_state_dict = model.state_dict()
-    if torch.cuda.is_available():
+BACKENDS = ('eager', 'frozen', 'int8')
+
+# load_state_dict(assign=True) is only available in newer torch versions
+_can_assign = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+def _load_model(position, model_path, use_cuda=None, model_type='lstm'):
+    from douzero.dmc.models import model_families
+    model_class = model_families[model_type][position]
+    if use_cuda is None:
+        use_cuda = torch.cuda.is_available()
+    if model_path.endswith(mmap_checkpoint.SUFFIX):
+        pretrained = mmap_checkpoint.load_state_dict(model_path, position)
+        if not use_cuda and _can_assign:
+            model = _mapped_model(model_class, pretrained)
+            if model is not None:
+                return model
+    elif use_cuda:
         pretrained = torch.load(model_path, map_location='cuda:0')
     else:
         pretrained = torch.load(model_path, map_location='cpu')
+    model = model_class()
+    model_state_dict = model.state_dict()
     pretrained = {k: v for k, v in pretrained.items() if k in model_state_dict}
     model_state_dict.update(pretrained)
     model.load_state_dict(model_state_dict)
-    if torch.cuda.is_available():
+    if use_cuda:
         model.cuda()
     model.eval()
     return model
 
+def _mapped_model(model_class, pretrained):
+    """
+    Build the model without initializing its weights and use the
+    mapped tensors as its parameters, so nothing is copied. Returns
+    None if the checkpoint does not have all the weights.
+    """
+    with torch.device('meta'):
+        model = model_class()
+    names = model.state_dict().keys()
+    if not all(name in pretrained for name in names):
+        return None
+    model.load_state_dict({name: pretrained[name] for name in names}, assign=True)
+    model.eval()
+    return model
+
+class _ValueHead(torch.nn.Module):
+    """
+    The value branch of a model as a plain (z, x) -> values module,
+    so that it can be traced.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, z, x):
+        return self.model.forward(z, x, return_value=True)['values']
+
+def _x_dim(position):
+    return 373 if position == 'landlord' else 484
+
+def _freeze_model(model, position):
+    """
+    Trace the value head of an eager CPU model and freeze it for
+    inference. It is traced with a single history shared by all
+    the actions, which is how `DeepAgent.act` calls it, and works
+    for any number of legal actions.
+    """
+    z = torch.zeros(1, 5, 162)
+    x = torch.zeros(2, _x_dim(position))
+    with torch.no_grad(), warnings.catch_warnings():
+        # The broadcast check in `forward` is fixed at trace time, as intended
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        frozen = torch.jit.trace(_ValueHead(model).eval(), (z, x))
+    # Freezing inlines the weights as constants; not available in old torch versions
+    if hasattr(torch.jit, 'freeze'):
+        frozen = torch.jit.freeze(frozen)
+    if hasattr(torch.jit, 'optimize_for_inference'):
+        frozen = torch.jit.optimize_for_inference(frozen)
+    return frozen
+
+def _quantize_model(model):
+    """
+    Int8 dynamic quantization of an eager CPU model: the weights
+    of the Linear layers and the LSTM are stored as int8, and the
+    activations are quantized on the fly, so no calibration data
+    is needed. Use quantize_check.py to validate it.
+    """
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+
+def _use_cuda(backend):
+    return torch.cuda.is_available() and backend == 'eager'
+
+def _build_model(position, model_path, backend, model_type='lstm'):
+    model = _load_model(position, model_path, _use_cuda(backend), model_type)
+    if backend == 'frozen':
+        model = _freeze_model(model, position)
+    elif backend == 'int8':
+        model = _quantize_model(model)
+    return model
+
 class DeepAgent:
+    """
+    `backend` selects how the model is run:
+        eager: the plain PyTorch model, on GPU if there is one
+        frozen: a traced and frozen TorchScript module, on CPU
+        int8: the model with int8 dynamically quantized Linear
+            and LSTM layers, on CPU
+
+    `model_type` is the model family of the checkpoint, one of
+    `douzero.dmc.models.model_families`; `factored` runs the `lstm`
+    checkpoints with the state part of the first layer computed
+    once per decision.
+
+    With `kicker_top_n`, only the `kicker_top_n` best kicker choices
+    of every airplane and four-with-two body are scored (see
+    kicker_pruning.py). None scores all the legal actions.
 
-    def __init__(self, position, model_path):
-        self.model = _load_model(position, model_path)
+    The model is taken from the process-wide registry, so agents
+    created with the same checkpoint, backend and model type share
+    one module.
+
+    An agent can be shared between threads: every thread gets its
+    own history encoder and observation buffer. The obs returned by
+    `evaluate` is only valid until the same thread's next call.
+    """
+    def __init__(self, position, model_path, backend='eager', model_type='lstm', kicker_top_n=None):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend: {}'.format(backend))
+        self.position = position
+        self.backend = backend
+        self.model_type = model_type
+        self.kicker_top_n = kicker_top_n
+        self.use_cuda = _use_cuda(backend)
+        self.model = registry.get(position, model_path, backend, model_type)
+        self._local = threading.local()
+
+    def _encoders(self):
+        # The history encoder and obs buffer of the calling thread
+        local = self._local
+        if not hasattr(local, 'history'):
+            local.history = HistoryEncoder()
+            local.obs_buffer = ObsBuffer()
+        return local.history, local.obs_buffer
+
+    def warmup(self, num_actions=8):
+        """
+        Run one dummy batch so that the first real decision does
+        not pay for lazy initialization.
+        """
+        z = torch.zeros(1, 5, 162)
+        x_batch = torch.zeros(num_actions, _x_dim(self.position))
+        if self.use_cuda:
+            z, x_batch = z.cuda(), x_batch.cuda()
+        self.predict(z, x_batch)
+
+    def predict(self, z, x_batch):
+        """
+        Values of all the actions in `x_batch` given one history `z`.
+        """
+        with torch.no_grad():
+            if self.backend == 'frozen':
+                return self.model(z, x_batch)
+            return self.model.forward(z, x_batch, return_value=True)['values']
+
+    def evaluate(self, infoset):
+        """
+        The observation of `infoset` and the values of its legal
+        actions, as a numpy array of shape (num_actions, 1). With
+        kicker pruning, these are the actions in obs['legal_actions'].
+        obs['x_batch'] is overwritten by the next call from the same
+        thread.
+        """
+        if self.kicker_top_n is not None:
+            with timers.timed('kicker_pruning'):
+                legal_actions = prune_kickers(infoset.legal_actions, infoset.player_hand_cards, self.kicker_top_n)
+            if len(legal_actions) < len(infoset.legal_actions):
+                infoset = copy.copy(infoset)
+                infoset.legal_actions = legal_actions
+        with timers.timed('get_obs'):
+            history, obs_buffer = self._encoders()
+            obs = get_obs(infoset, history, obs_buffer)
+        with timers.timed('forward'):
+            # The history is the same for every legal action, so only
+            # one copy of it is fed to the model
+            z = torch.from_numpy(obs['z'][np.newaxis]).float()
+            x_batch = torch.from_numpy(obs['x_batch']).float()
+            if self.use_cuda:
+                z, x_batch = z.cuda(), x_batch.cuda()
+            y_pred = self.predict(z, x_batch)
+            y_pred = y_pred.detach().cpu().numpy()
+        return obs, y_pred
 
     def act(self, infoset):
         # 只有一个合法动作时直接返回，这样会得不到胜率信息
         # if len(infoset.legal_actions) == 1:
         #     return infoset.legal_actions[0], 0
 
-        obs = get_obs(infoset)
-        z_batch = torch.from_numpy(obs['z_batch']).float()
-        x_batch = torch.from_numpy(obs['x_batch']).float()
-        if torch.cuda.is_available():
-            z_batch, x_batch = z_batch.cuda(), x_batch.cuda()
-        y_pred = self.model.forward(z_batch, x_batch, return_value=True)['values']
-        y_pred = y_pred.detach().cpu().numpy()
-
+        obs, y_pred = self.evaluate(infoset)
         best_action_index = np.argmax(y_pred, axis=0)[0]
-        best_action = infoset.legal_actions[best_action_index]
+        best_action = obs['legal_actions'][best_action_index]
         best_action_confidence = y_pred[best_action_index]
         # print(best_action, best_action_confidence, y_pred)
         return best_action, best_action_confidence
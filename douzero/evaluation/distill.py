@@ -0,0 +1,189 @@
+"""
+Distill the LSTM models into small student models for fast CPU play.
+
+1. The teacher agents play games against each other (with some
+   random moves for variety), and every legal action of every
+   decision is labelled with the teacher's value.
+2. A student (`model_families['student']`) is trained per position
+   to reproduce these values.
+3. The students are saved as .ckpt files in `out_dir`, which
+   `DeepAgent(position, path, model_type='student')` loads.
+4. On games the students have not seen, the pipeline reports how
+   often student and teacher pick the same action. It also plays
+   students against teachers on the same deals.
+
+    python -m douzero.evaluation.distill --teacher_dir baselines/douzero_WP --out_dir baselines/student_WP
+"""
+import os
+import sys
+import json
+import random
+import argparse
+
+import numpy as np
+import torch
+
+from douzero.env.game import GameEnv
+from douzero.dmc.models import model_families
+from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.self_play import deal, head_to_head, play_game
+
+POSITIONS = ['landlord', 'landlord_up', 'landlord_down']
+
+
+class Sample(object):
+    """
+    One decision: the history, the state features shared by all
+    the actions, the 54-dim encoding of each action and the
+    teacher's values. The features are 0/1 and are kept as uint8.
+    """
+    __slots__ = ('z', 'state', 'actions', 'values')
+
+    def __init__(self, obs, values):
+        self.z = obs['z'].astype(np.uint8)
+        self.state = obs['x_no_action'].astype(np.uint8)
+        self.actions = obs['x_batch'][:, -54:].astype(np.uint8)
+        self.values = values[:, 0].astype(np.float32)
+
+
+def _teacher_policy(agent, samples, rng, epsilon):
+    def policy(infoset):
+        obs, values = agent.evaluate(infoset)
+        # A single legal action says nothing about the ranking
+        if len(infoset.legal_actions) > 1:
+            samples.append(Sample(obs, values))
+        if rng.random() < epsilon:
+            return rng.choice(infoset.legal_actions)
+        return obs['legal_actions'][int(np.argmax(values[:, 0]))]
+    return policy
+
+
+def collect(teachers, num_games, seed=0, epsilon=0.1):
+    """
+    Play `num_games` games with the teacher agents, each move
+    random with probability `epsilon`, and return the samples of
+    every position.
+    """
+    rng = random.Random(seed)
+    samples = {p: [] for p in POSITIONS}
+    policies = {p: _teacher_policy(teachers[p], samples[p], rng, epsilon) for p in POSITIONS}
+    env = GameEnv([None, None])
+    for _ in range(num_games):
+        play_game(env, policies, deal(rng))
+    return samples
+
+
+def _batch(samples):
+    # z_index lets the decisions of the batch share one forward pass
+    z = torch.from_numpy(np.stack([s.z for s in samples])).float()
+    sizes = [len(s.actions) for s in samples]
+    state = np.concatenate([np.repeat(s.state[np.newaxis], n, axis=0) for s, n in zip(samples, sizes)])
+    actions = np.concatenate([s.actions for s in samples])
+    x = torch.from_numpy(np.hstack([state, actions])).float()
+    z_index = torch.from_numpy(np.repeat(np.arange(len(samples)), sizes))
+    values = torch.from_numpy(np.concatenate([s.values for s in samples]))
+    return z, x, z_index, values, sizes
+
+
+def train_student(position, samples, epochs=10, batch_size=64, lr=1e-3, seed=0):
+    """
+    Fit a student to the teacher's values of `samples` with the
+    mean squared error, as DMC does with the returns.
+    """
+    torch.manual_seed(seed)
+    rng = np.random.RandomState(seed)
+    model = model_families['student'][position]()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    for epoch in range(epochs):
+        order = rng.permutation(len(samples))
+        losses = []
+        for start in range(0, len(order), batch_size):
+            z, x, z_index, values, _ = _batch([samples[i] for i in order[start:start + batch_size]])
+            pred = model.forward(z, x, return_value=True, z_index=z_index)['values'][:, 0]
+            loss = ((pred - values) ** 2).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        print('{} epoch {}: loss {:.5f}'.format(position, epoch + 1, np.mean(losses)))
+    model.eval()
+    return model
+
+
+def agreement(model, samples, batch_size=256):
+    """
+    The share of `samples` where the model picks the teacher's
+    best action, and the mean absolute error of its values.
+    """
+    agree, errors = 0, []
+    with torch.no_grad():
+        for start in range(0, len(samples), batch_size):
+            batch = samples[start:start + batch_size]
+            z, x, z_index, values, sizes = _batch(batch)
+            pred = model.forward(z, x, return_value=True, z_index=z_index)['values'][:, 0]
+            errors.append((pred - values).abs().numpy())
+            for p, v in zip(torch.split(pred, sizes), torch.split(values, sizes)):
+                agree += int(p.argmax() == v.argmax())
+    return agree / max(len(samples), 1), float(np.concatenate(errors).mean()) if errors else 0.0
+
+
+def distill(teacher_paths, out_dir, games=200, eval_games=20, match_games=100,
+            epochs=10, epsilon=0.1, seed=0):
+    """
+    Run the whole pipeline and return the report. The students
+    are saved as out_dir/<position>.ckpt.
+    """
+    teachers = {p: DeepAgent(p, teacher_paths[p]) for p in POSITIONS}
+    print('Collecting {} training games...'.format(games))
+    train_samples = collect(teachers, games, seed, epsilon)
+    # Held-out games, played by the teachers without random moves
+    eval_samples = collect(teachers, eval_games, seed + 1, 0.0)
+
+    os.makedirs(out_dir, exist_ok=True)
+    report = {'positions': {}}
+    student_paths = {}
+    for p in POSITIONS:
+        model = train_student(p, train_samples[p], epochs, seed=seed)
+        student_paths[p] = os.path.join(out_dir, p + '.ckpt')
+        torch.save(model.state_dict(), student_paths[p])
+        agree, mae = agreement(model, eval_samples[p])
+        report['positions'][p] = {'train_decisions': len(train_samples[p]),
+                                  'eval_decisions': len(eval_samples[p]),
+                                  'agreement': agree, 'value_mae': mae}
+        print('{}: agreement {:.2%}, value MAE {:.4f}'.format(p, agree, mae))
+
+    students = {p: DeepAgent(p, student_paths[p], model_type='student') for p in POSITIONS}
+    print('Playing {} games per seating...'.format(match_games))
+    rates = head_to_head(teachers, students, match_games, seed + 2)
+    report['landlord_win_rate'] = {'teacher_vs_teacher': rates['a_vs_a'],
+                                   'student_landlord': rates['b_landlord'],
+                                   'student_farmers': rates['b_farmers']}
+    for name, rate in report['landlord_win_rate'].items():
+        print('{}: landlord wins {:.2%}'.format(name, rate))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill the LSTM models into small student models')
+    parser.add_argument('--teacher_dir', default='baselines/douzero_WP', help='Directory with the three .ckpt files')
+    parser.add_argument('--out_dir', default='baselines/student_WP', help='Directory to save the students to')
+    parser.add_argument('--games', default=200, type=int, help='Self-play games to train on')
+    parser.add_argument('--eval_games', default=20, type=int, help='Held-out games to measure agreement on')
+    parser.add_argument('--match_games', default=100, type=int, help='Games per seating in the head-to-head')
+    parser.add_argument('--epochs', default=10, type=int)
+    parser.add_argument('--epsilon', default=0.1, type=float, help='Probability of a random move in self-play')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--json', default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+
+    teacher_paths = {p: os.path.join(args.teacher_dir, p + '.ckpt') for p in POSITIONS}
+    report = distill(teacher_paths, args.out_dir, args.games, args.eval_games, args.match_games,
+                     args.epochs, args.epsilon, args.seed)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Kicker pruning before the actions are scored by the model.
+
+Airplanes with wings (serial 3+1 and 3+2) and four with two
+(4+2 and 4+22) are generated with every combination of kickers. A
+hand with a bomb and many singles can have dozens of them, and every
+one goes through `get_obs` and the network.
+
+`prune_kickers` groups these actions by their main body (the
+triples or the four of a kind). In each group it keeps only the
+`top_n` kicker choices that a cheap rule ranks best, and it leaves
+all other actions alone. The rule prefers low cards and avoids
+breaking up pairs, triples, bombs and the rocket.
+"""
+import collections
+
+from douzero.env import move_detector as md
+
+KICKER_TYPES = (md.TYPE_11_SERIAL_3_1, md.TYPE_12_SERIAL_3_2,
+                md.TYPE_13_4_2, md.TYPE_14_4_22)
+
+# 3 -> 0, ..., A -> 11, 2 -> 12, X -> 13, D -> 14
+_ORDER = {card: i for i, card in enumerate([3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 17, 20, 30])}
+
+BREAK_COST = 15  # leaving part of a pair or triple in hand
+BOMB_COST = 40  # breaking a bomb or the rocket
+
+
+def _body(move_type):
+    """
+    The main body of an action with kickers: the card ranks and
+    how many of each.
+    """
+    if move_type['type'] in (md.TYPE_13_4_2, md.TYPE_14_4_22):
+        return [move_type['rank']], 4
+    # Serial triples use consecutive ranks, none above A
+    return list(range(move_type['rank'], move_type['rank'] + move_type['len'])), 3
+
+
+def kicker_cost(kickers, hand):
+    """
+    How much playing `kickers` costs, given the counts of the cards
+    in `hand`. Lower is better.
+    """
+    cost = 0
+    for card, used in collections.Counter(kickers).items():
+        cost += _ORDER[card] * used
+        left = hand[card] - used
+        if hand[card] == 4:
+            cost += BOMB_COST
+        elif left > 0 and hand[card] >= 2:
+            cost += BREAK_COST
+    if (20 in kickers) != (30 in kickers) and hand[20] and hand[30]:
+        cost += BOMB_COST
+    return cost
+
+
+def prune_kickers(legal_actions, hand_cards, top_n=2):
+    """
+    `legal_actions` with at most `top_n` kicker choices for every
+    main body. The order of the kept actions is unchanged.
+    """
+    groups = collections.defaultdict(list)
+    for i, action in enumerate(legal_actions):
+        # Only actions of 6 or more cards can carry kickers
+        if len(action) < 6:
+            continue
+        move_type = md.get_move_type(action)
+        if move_type['type'] in KICKER_TYPES:
+            ranks, count = _body(move_type)
+            groups[(move_type['type'], ranks[0], len(ranks))].append((i, ranks, count))
+
+    dropped = set()
+    hand = collections.Counter(hand_cards)
+    for members in groups.values():
+        if len(members) <= top_n:
+            continue
+        costs = []
+        for i, ranks, count in members:
+            kickers = list(legal_actions[i])
+            for rank in ranks:
+                for _ in range(count):
+                    kickers.remove(rank)
+            costs.append((kicker_cost(kickers, hand), i))
+        # sorted is stable, so ties keep the generation order
+        dropped.update(i for _, i in sorted(costs)[top_n:])
+    if not dropped:
+        return legal_actions
+    return [action for i, action in enumerate(legal_actions) if i not in dropped]
@@ -0,0 +1,123 @@
+"""
+A flat checkpoint format that can be memory-mapped.
+
+One file holds the weights of all three positions:
+
+    8 bytes    magic, b'DZMMAP01'
+    8 bytes    length of the JSON header, little-endian uint64
+    header     {"version": 1, "alignment": 64, "models": {position:
+               {name: {"dtype", "shape", "offset"}}}}
+    data       starts at the first multiple of 64 after the header;
+               every tensor is stored at `offset` from there, and
+               every offset is a multiple of 64
+
+The loader maps the file copy-on-write and returns tensors that are
+views of the mapping, so processes loading the same file share one
+page-cached copy of the weights. Convert the .ckpt files with
+
+    python -m douzero.evaluation.mmap_checkpoint baselines/douzero_WP baselines/douzero_WP.dzmm
+"""
+import os
+import sys
+import json
+import struct
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+MAGIC = b'DZMMAP01'
+ALIGNMENT = 64
+SUFFIX = '.dzmm'
+POSITIONS = ['landlord', 'landlord_up', 'landlord_down']
+
+# path -> (mtime, header, mapping, data_start), shared by the three
+# positions. A rewritten file replaces the entry of its old version; the
+# old mapping is unmapped once no model uses its tensors any more.
+_mappings = {}
+_lock = threading.Lock()
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def convert(model_path_dict, out_path):
+    """
+    Write the state dicts of `model_path_dict` (position -> .ckpt
+    path) into one mappable file.
+    """
+    header = {'version': 1, 'alignment': ALIGNMENT, 'models': {}}
+    arrays = []
+    offset = 0
+    for position, path in model_path_dict.items():
+        state_dict = torch.load(path, map_location='cpu')
+        entries = header['models'][position] = OrderedDict()
+        for name, tensor in state_dict.items():
+            array = tensor.detach().contiguous().numpy()
+            offset = _align(offset)
+            entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            arrays.append((offset, array))
+            offset += array.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, out_path)
+
+
+def _open(path):
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        entry = _mappings.get(path)
+        if entry is None or entry[0] != mtime:
+            mapping = np.memmap(path, dtype=np.uint8, mode='c')
+            if mapping[:len(MAGIC)].tobytes() != MAGIC:
+                raise ValueError('{} is not a mapped checkpoint'.format(path))
+            header_len = struct.unpack('<Q', mapping[len(MAGIC):len(MAGIC) + 8].tobytes())[0]
+            header_end = len(MAGIC) + 8 + header_len
+            header = json.loads(mapping[len(MAGIC) + 8:header_end].tobytes().decode('utf-8'))
+            entry = _mappings[path] = (mtime, header, mapping, _align(header_end))
+        return entry[1:]
+
+
+def load_state_dict(path, position):
+    """
+    The state dict of `position`, as tensors that are views of
+    the mapped file.
+    """
+    header, mapping, data_start = _open(path)
+    if position not in header['models']:
+        raise KeyError('{} has no {} model'.format(path, position))
+    state_dict = OrderedDict()
+    for name, entry in header['models'][position].items():
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        nbytes = int(np.prod(entry['shape'], dtype=np.int64)) * dtype.itemsize
+        array = np.asarray(mapping[start:start + nbytes]).view(dtype).reshape(entry['shape'])
+        state_dict[name] = torch.from_numpy(array)
+    return state_dict
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the three .ckpt files into one mapped checkpoint')
+    parser.add_argument('model_dir', help='Directory with landlord.ckpt, landlord_up.ckpt and landlord_down.ckpt')
+    parser.add_argument('out_path', help='Output file, e.g. baselines/douzero_WP' + SUFFIX)
+    args = parser.parse_args()
+    convert({p: os.path.join(args.model_dir, p + '.ckpt') for p in POSITIONS}, args.out_path)
+    print('Wrote {} ({} bytes)'.format(args.out_path, os.path.getsize(args.out_path)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+A process-wide registry of the loaded models. Each model is
+loaded once per (position, checkpoint path, backend, model type)
+and shared by every `DeepAgent` that asks for it. A checkpoint
+that has been modified since it was loaded (different mtime) is
+loaded again.
+"""
+import os
+import threading
+
+
+class ModelRegistry(object):
+
+    def __init__(self):
+        # (position, path, backend, model_type) -> (mtime, model)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, position, model_path, backend='eager', model_type='lstm'):
+        """
+        The shared eval-mode model for the checkpoint, loading it
+        if it is not loaded yet or the file has changed.
+        """
+        from douzero.evaluation.deep_agent import _build_model
+        path = os.path.abspath(model_path)
+        mtime = os.stat(path).st_mtime_ns
+        key = (position, path, backend, model_type)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None or entry[0] != mtime:
+                entry = self._models[key] = (mtime, _build_model(position, path, backend, model_type))
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def warmup(self, model_path_dict, backend='eager', background=True, model_type='lstm'):
+        """
+        Load the models in `model_path_dict` (position -> path) and
+        run a dummy batch through each. With `background`, this is
+        done in a daemon thread, which is returned.
+        """
+        def run():
+            from douzero.evaluation.deep_agent import DeepAgent
+            for position, path in model_path_dict.items():
+                try:
+                    DeepAgent(position, path, backend, model_type).warmup()
+                except (OSError, RuntimeError) as e:
+                    print('Failed to warm up the {} model: {}'.format(position, e))
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+registry = ModelRegistry()
@@ -21,11 +21,9 @@ class RLCardAgent(object):
 
     def act(self, infoset):
         try:
-            # Hand cards
-            hand_cards = infoset.player_hand_cards
-            for i, c in enumerate(hand_cards):
-                hand_cards[i] = EnvCard2RealCard[c]
-            hand_cards = ''.join(hand_cards)
+            # Hand cards. The infoset is shared with the game, so its
+            # lists are converted into new ones
+            hand_cards = ''.join([EnvCard2RealCard[c] for c in infoset.player_hand_cards])
 
             # Last move
             last_move = infoset.last_move.copy()
@@ -34,11 +32,8 @@ class RLCardAgent(object):
             last_move = ''.join(last_move)
 
             # Last two moves
-            last_two_cards = infoset.last_two_moves
-            for i in range(2):
-                for j, c in enumerate(last_two_cards[i]):
-                    last_two_cards[i][j] = EnvCard2RealCard[c]
-                last_two_cards[i] = ''.join(last_two_cards[i])
+            last_two_cards = [''.join([EnvCard2RealCard[c] for c in move])
+                              for move in infoset.last_two_moves]
 
             # Last pid
             last_pid = infoset.last_pid
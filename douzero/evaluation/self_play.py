@@ -0,0 +1,89 @@
+"""
+Self-play on `GameEnv` with full information, used by the offline
+tools to record infosets and to pit agents against each other.
+
+`GameEnv` here is set up for the assistant: `players[0]` is the
+user's position, and only that player's hand is tracked card by
+card. For self-play, `players[0]` is switched to the acting
+position before every step, so all three hands stay exact.
+"""
+import random
+
+from douzero.env.game import GameEnv, AllEnvCard
+
+
+def deal(rng):
+    """
+    Shuffle a deck with `rng` (a `random.Random`) and deal it.
+    """
+    deck = AllEnvCard.copy()
+    rng.shuffle(deck)
+    return {'landlord': sorted(deck[:20]),
+            'landlord_up': sorted(deck[20:37]),
+            'landlord_down': sorted(deck[37:54]),
+            'three_landlord_cards': sorted(deck[17:20])}
+
+
+def play_game(env, policies, card_play_data, on_decision=None):
+    """
+    Play one game. `policies` maps each position to a function
+    from infoset to action. `on_decision(infoset, action)` is
+    called for every move. Returns the winner, landlord or farmer.
+    """
+    env.reset()
+    env.card_play_init(card_play_data)
+    while not env.game_over:
+        position = env.acting_player_position
+        infoset = env.game_infoset
+        action = policies[position](infoset)
+        if on_decision is not None:
+            on_decision(infoset, action)
+        env.players[0] = position
+        env.step(None, action)
+    return env.winner
+
+
+def agent_policy(agent):
+    # DeepAgent.act returns (action, value)
+    return lambda infoset: agent.act(infoset)[0]
+
+
+def random_policy(rng):
+    return lambda infoset: rng.choice(infoset.legal_actions)
+
+
+def head_to_head(agents_a, agents_b, num_games, seed=0):
+    """
+    Landlord win rates on the same `num_games` deals with `agents_a`
+    in every seat ('a_vs_a'), with the landlord of `agents_b` against
+    the farmers of `agents_a` ('b_landlord'), and with the landlord
+    of `agents_a` against the farmers of `agents_b` ('b_farmers').
+    Both map each position to an agent.
+    """
+    seatings = {
+        'a_vs_a': agents_a,
+        'b_landlord': dict(agents_a, landlord=agents_b['landlord']),
+        'b_farmers': dict(agents_b, landlord=agents_a['landlord']),
+    }
+    env = GameEnv([None, None])
+    result = {}
+    for name, agents in seatings.items():
+        rng = random.Random(seed)
+        policies = {p: agent_policy(agent) for p, agent in agents.items()}
+        wins = sum(play_game(env, policies, deal(rng)) == 'landlord' for _ in range(num_games))
+        result[name] = wins / max(num_games, 1)
+    return result
+
+
+def self_play_infosets(policies, num_games, seed=0):
+    """
+    Play `num_games` games and return the infosets of all the
+    decisions, in order.
+    """
+    rng = random.Random(seed)
+    env = GameEnv([None, None])
+    infosets = []
+    for _ in range(num_games):
+        play_game(env, policies, deal(rng),
+                  on_decision=lambda infoset, action: infosets.append(infoset))
+    return infosets
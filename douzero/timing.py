@@ -0,0 +1,158 @@
+"""
+Lightweight per-stage latency timers.
+
+    from douzero.timing import timers
+
+    timers.enabled = True
+
+    with timers.timed('get_obs'):
+        obs = get_obs(infoset)
+
+    @timers.wrap('get_infoset')
+    def get_infoset(self):
+        ...
+
+Timing is off by default, so training and self-play do not pay for
+it; the GUI switches it on. Every stage keeps a rolling window of its recent samples, from which
+p50/p95 are computed. Between `start_game()` and `save()` every sample
+is also appended to a per-game log that can be written as CSV or JSON.
+"""
+import csv
+import json
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class _NullTimer(object):
+    # Shared by every `timed` block while timing is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ('timers', 'stage', 'start')
+
+    def __init__(self, timers, stage):
+        self.timers = timers
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timers.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimers(object):
+    """
+    Named timers shared by the capture thread, the rules engine and the
+    model. Timing is off until `enabled` is set to True. While it is
+    off, `timed` returns a shared no-op context and a function wrapped
+    with `wrap` costs one extra call and one attribute lookup.
+    """
+    def __init__(self, window=200):
+        self.window = window
+        self.enabled = False
+        self.recording = False
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()
+        self._log = []
+        self._game_start = None
+
+    def timed(self, stage):
+        # Context manager timing the block as `stage`
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, stage)
+
+    def wrap(self, stage):
+        """
+        Decorator timing every call of the function as `stage`.
+        `enabled` is checked on each call, not when decorating.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def add(self, stage, seconds):
+        with self._lock:
+            samples = self._recent.get(stage)
+            if samples is None:
+                samples = self._recent[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+            if self.recording:
+                self._log.append((time.time() - self._game_start, stage, seconds))
+
+    def stats(self):
+        # stage -> {'n', 'last', 'p50', 'p95'}, times in milliseconds
+        with self._lock:
+            recent = [(stage, np.array(samples)) for stage, samples in self._recent.items()]
+        result = OrderedDict()
+        for stage, samples in recent:
+            p50, p95 = np.percentile(samples * 1000, [50, 95])
+            result[stage] = {'n': len(samples), 'last': float(samples[-1] * 1000),
+                             'p50': float(p50), 'p95': float(p95)}
+        return result
+
+    def summary(self, stages=None):
+        # One "stage p50/p95" entry per stage, for a status label
+        stats = self.stats()
+        stages = stats.keys() if stages is None else [s for s in stages if s in stats]
+        return '  '.join('%s %.1f/%.1f' % (stage, stats[stage]['p50'], stats[stage]['p95'])
+                         for stage in stages)
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._log = []
+
+    def start_game(self):
+        # Start a fresh per-game log; the rolling windows are kept
+        with self._lock:
+            self._log = []
+            self._game_start = time.time()
+            self.recording = True
+
+    def save(self, path):
+        """
+        Write the current game's samples and the rolling stats to `path`
+        (JSON if it ends with .json, CSV otherwise) and stop recording.
+        """
+        with self._lock:
+            log = list(self._log)
+            self.recording = False
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'stats': self.stats(),
+                           'samples': [{'t': t, 'stage': stage, 'ms': seconds * 1000}
+                                       for t, stage, seconds in log]}, f, indent=2)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['t', 'stage', 'ms'])
+                for t, stage, seconds in log:
+                    writer.writerow(['%.6f' % t, stage, '%.3f' % (seconds * 1000)])
+
+
+timers = StageTimers()
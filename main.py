@@ -11,11 +11,14 @@ import pyautogui
 from PyQt5 import QtGui, QtWidgets, QtCore
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem, QGraphicsPixmapItem, QInputDialog, QMessageBox
 from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtCore import QTime, QEventLoop
 from MainWindowUI import Ui_Form
 
 from douzero.env.game import GameEnv
 from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.model_registry import registry
+from douzero.timing import timers
+from recognition.reader import CardReader
+from recognition.watcher import RegionWatcher
 
 EnvCard2RealCard = {3: '3', 4: '4', 5: '5', 6: '6', 7: '7',
                     8: '8', 9: '9', 10: 'T', 11: 'J', 12: 'Q',
@@ -29,11 +32,80 @@ AllEnvCard = [3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 6, 6, 6, 6, 7, 7, 7, 7,
               8, 8, 8, 8, 9, 9, 9, 9, 10, 10, 10, 10, 11, 11, 11, 11, 12,
               12, 12, 12, 13, 13, 13, 13, 14, 14, 14, 14, 17, 17, 17, 17, 20, 30]
 
-AllCards = ['rD', 'bX', 'b2', 'r2', 'bA', 'rA', 'bK', 'rK', 'bQ', 'rQ', 'bJ', 'rJ', 'bT', 'rT',
-            'b9', 'r9', 'b8', 'r8', 'b7', 'r7', 'b6', 'r6', 'b5', 'r5', 'b4', 'r4', 'b3', 'r3']
 
+class GameWorker(QtCore.QThread):
+    # 出牌循环：截图 -> 识别 -> env.step -> 推理，结果通过信号交给界面线程显示
+    waiting = QtCore.pyqtSignal(int)  # 正在等待的一方(出牌顺序)
+    ai_played = QtCore.pyqtSignal(str, str, str)  # 手牌、AI出牌、胜率
+    other_played = QtCore.pyqtSignal(int, str)  # 出牌顺序、识别到的出牌
+    game_finished = QtCore.pyqtSignal(str)  # 胜方
 
-class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
+    def __init__(self, reader, env, user_position, play_order):
+        super(GameWorker, self).__init__()
+        # reader 只提供识别函数、出牌区域监视器和参数；对局状态都由工作线程自己保存，不读写界面对象的属性
+        self.reader = reader
+        self.env = env
+        self.user_position = user_position
+        self.play_order = play_order  # 出牌顺序：0-玩家出牌, 1-玩家下家出牌, 2-玩家上家出牌
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        # 正在等待的采样间隔会被立即打断
+        self.stop_event.set()
+
+    def should_stop(self):
+        return self.stop_event.is_set() or self.env.game_over
+
+    def run(self):
+        reader = self.reader
+        while not self.should_stop():
+            # 玩家出牌时就通过智能体获取action，否则通过识别获取其他玩家出牌
+            if self.play_order == 0:
+                self.waiting.emit(0)
+                action_message = self.env.step(self.user_position)
+                hand_cards = ''.join(
+                    [EnvCard2RealCard[c] for c in self.env.info_sets[self.user_position].player_hand_cards])
+                # 更新界面
+                self.ai_played.emit(hand_cards, action_message["action"], action_message["win_rate"])
+                print("\n手牌：", hand_cards)
+                print("出牌：", action_message["action"] if action_message["action"] else "不出", "， 胜率：",
+                      action_message["win_rate"])
+                # 等待下家出牌区域清空
+                print("等待玩家出牌")
+                reader.RWatcher.wait_until(lambda img: reader.have_white(img) == 0 and not reader.find_pass(img),
+                                           self.stop_event.wait, self.should_stop)
+                self.play_order = 1
+            elif self.play_order in (1, 2):
+                self.waiting.emit(self.play_order)
+                print("等待下家出牌" if self.play_order == 1 else "等待上家出牌")
+                watcher = reader.RWatcher if self.play_order == 1 else reader.LWatcher
+                # 出牌区域变化并稳定后才识别
+                img = watcher.wait_until(lambda img: reader.have_white(img) == 1 or reader.find_pass(img),
+                                         self.stop_event.wait, self.should_stop)
+                if img is None:
+                    break
+                # 不出
+                pass_flag = reader.find_pass(img)
+                # 未找到"不出"
+                if pass_flag is None:
+                    # 识别下家/上家出牌
+                    other_played_cards_real = reader.find_other_cards(img)
+                # 找到"不出"
+                else:
+                    other_played_cards_real = ""
+                print("\n下家出牌：" if self.play_order == 1 else "\n上家出牌：", other_played_cards_real)
+                other_played_cards_env = [RealCard2EnvCard[c] for c in list(other_played_cards_real)]
+                self.env.step(self.user_position, other_played_cards_env)
+                # 更新界面
+                self.other_played.emit(self.play_order, other_played_cards_real)
+                self.play_order = (self.play_order + 1) % 3
+
+            self.stop_event.wait(reader.SleepTime)
+
+        self.game_finished.emit(self.env.winner)
+
+
+class MyPyQT_Form(QtWidgets.QWidget, Ui_Form, CardReader):
     def __init__(self):
         super(MyPyQT_Form, self).__init__()
         self.setupUi(self)
@@ -47,36 +119,52 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
         self.setPalette(window_pale)
 
         self.Players = [self.RPlayer, self.Player, self.LPlayer]
-        self.counter = QTime()
-
-        # 参数
-        self.MyConfidence = 0.95  # 我的牌的置信度
-        self.OtherConfidence = 0.9  # 别人的牌的置信度
-        self.WhiteConfidence = 0.9  # 检测白块的置信度
-        self.LandlordFlagConfidence = 0.9     # # 检测地主标志的置信度
-        self.ThreeLandlordCardsConfidence = 0.9  # 检测地主底牌的置信度
+
+        # 参数(识别相关的参数和截图坐标见 recognition/reader.py)
         self.WaitTime = 1  # 等待状态稳定延时
-        self.MyFilter = 40  # 我的牌检测结果过滤参数
-        self.OtherFilter = 25  # 别人的牌检测结果过滤参数
         self.SleepTime = 0.1  # 循环中睡眠时间
-
-        # 坐标
-        self.MyHandCardsPos = (414, 804, 1041, 59)  # 我的截图区域
-        self.LPlayedCardsPos = (530, 470, 380, 160)  # 左边截图区域
-        self.RPlayedCardsPos = (1010, 470, 380, 160)  # 右边截图区域
-        self.LandlordFlagPos = [(1320, 300, 110, 140), (320, 720, 110, 140), (500, 300, 110, 140)]  # 地主标志截图区域(右-我-左)
-        self.ThreeLandlordCardsPos = (817, 36, 287, 136)      # 地主底牌截图区域，resize成349x168
+        self.WatchInterval = 0.05  # 出牌区域采样间隔
+        self.SettleFrames = 2  # 连续多少次采样不变才算出牌完成
+        self.ChangeThreshold = 2.0  # 缩略图平均灰度差超过该值才算区域发生变化
+        self.ShowTimings = False  # 在界面上显示各阶段耗时 p50/p95(毫秒)
+        self.TimingLogDir = "timing_logs"  # 每局的各阶段耗时记录保存目录，None 表示不保存
+        self.TimingLogFormat = "csv"  # 耗时记录格式：csv 或 json
+        timers.enabled = self.ShowTimings or self.TimingLogDir is not None  # 计时默认关闭，需要显示或保存时才打开
+
+        # 识别器与截图
+        self.init_reader(lambda box: pyautogui.screenshot(region=box))
+        self.LWatcher = RegionWatcher(self.Frames.grabber('LPlayedCards'),
+                                      self.WatchInterval, self.SettleFrames, self.ChangeThreshold)
+        self.RWatcher = RegionWatcher(self.Frames.grabber('RPlayedCards'),
+                                      self.WatchInterval, self.SettleFrames, self.ChangeThreshold)
+
+        # 耗时显示
+        self.TimingLabel = None
+        if self.ShowTimings:
+            self.TimingLabel = QtWidgets.QLabel(self)
+            self.TimingLabel.setGeometry(QtCore.QRect(10, 442, 421, 28))
+            self.TimingLabel.setFont(QtGui.QFont("Arial", 7))
+            self.TimingLabel.setWordWrap(True)
 
         # 信号量
         self.shouldExit = 0  # 通知上一轮记牌结束
         self.canRecord = threading.Lock()  # 开始记牌
-
-        # 模型路径
+        self.worker = None  # 出牌循环所在的工作线程
+
+        # 模型路径与推理后端：eager - PyTorch 原始模型，frozen - 冻结的 TorchScript 模型(CPU)，int8 - 动态量化模型(CPU)
+        self.InferenceBackend = 'eager'
+        # 模型结构：lstm - 原始模型，factored - 同一模型的快速实现，student - 蒸馏出的小模型(python -m douzero.evaluation.distill)
+        self.ModelType = 'lstm'
+        # 飞机带翅膀、四带二每个主体只保留几种代价最低的带牌再送入模型，None 表示不裁剪(效果可用 prune_bench.py 对比)
+        self.KickerTopN = None
+        # 也可以三个角色都填同一个 .dzmm 文件(python -m douzero.evaluation.mmap_checkpoint 转换)，权重直接映射，不用反序列化
         self.card_play_model_path_dict = {
             'landlord': "baselines/douzero_WP/landlord.ckpt",
             'landlord_up': "baselines/douzero_WP/landlord_up.ckpt",
             'landlord_down': "baselines/douzero_WP/landlord_down.ckpt"
         }
+        # 三个模型在后台一次性加载并预热，之后每局直接复用，开局不用再等待加载
+        registry.warmup(self.card_play_model_path_dict, self.InferenceBackend, model_type=self.ModelType)
 
     def init_display(self):
         self.WinRate.setText("胜率：--%")
@@ -90,12 +178,11 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
             player.setStyleSheet('background-color: rgba(255, 0, 0, 0);')
 
     def init_cards(self):
+        # 上一局还在进行时先停止工作线程并等它退出，再截图、重置对局状态
+        self.stop_worker()
         # 玩家手牌
         self.user_hand_cards_real = ""
         self.user_hand_cards_env = []
-        # 其他玩家出牌
-        self.other_played_cards_real = ""
-        self.other_played_cards_env = []
         # 其他玩家手牌（整副牌减去玩家手牌，后续再减掉历史出牌）
         self.other_hand_cards = []
         # 三张底牌
@@ -111,16 +198,19 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
 
         self.env = None
 
+        # 一次截图，各区域取视图识别
+        self.Frames.capture()
         # 识别玩家手牌
-        self.user_hand_cards_real = self.find_my_cards(self.MyHandCardsPos)
+        self.user_hand_cards_real = self.find_my_cards(self.Frames['MyHandCards'])
         self.UserHandCards.setText(self.user_hand_cards_real)
         self.user_hand_cards_env = [RealCard2EnvCard[c] for c in list(self.user_hand_cards_real)]
         # 识别三张底牌
-        self.three_landlord_cards_real = self.find_three_landlord_cards(self.ThreeLandlordCardsPos)
+        self.three_landlord_cards_real = self.find_three_landlord_cards(self.Frames['ThreeLandlordCards'])
         self.ThreeLandlordCards.setText("底牌：" + self.three_landlord_cards_real)
         self.three_landlord_cards_env = [RealCard2EnvCard[c] for c in list(self.three_landlord_cards_real)]
         # 识别玩家的角色
-        self.user_position_code = self.find_landlord(self.LandlordFlagPos)
+        self.user_position_code = self.find_landlord(
+            [self.Frames['LandlordFlag%d' % i] for i in range(len(self.LandlordFlagPos))])
         if self.user_position_code is None:
             items = ("地主上家", "地主", "地主下家")
             item, okPressed = QInputDialog.getItem(self, "选择角色", "未识别到地主，请手动选择角色:", items, 0, False)
@@ -163,7 +253,9 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
         # 创建一个代表玩家的AI
         ai_players = [0, 0]
         ai_players[0] = self.user_position
-        ai_players[1] = DeepAgent(self.user_position, self.card_play_model_path_dict[self.user_position])
+        ai_players[1] = DeepAgent(self.user_position, self.card_play_model_path_dict[self.user_position],
+                                  backend=self.InferenceBackend, model_type=self.ModelType,
+                                  kicker_top_n=self.KickerTopN)
 
         self.env = GameEnv(ai_players)
 
@@ -172,171 +264,73 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form):
     def start(self):
         self.env.card_play_init(self.card_play_data_list)
         print("开始出牌\n")
-        while not self.env.game_over:
-            # 玩家出牌时就通过智能体获取action，否则通过识别获取其他玩家出牌
-            if self.play_order == 0:
-                self.PredictedCard.setText("...")
-                action_message = self.env.step(self.user_position)
-                # 更新界面
-                self.UserHandCards.setText("手牌：" + str(''.join(
-                    [EnvCard2RealCard[c] for c in self.env.info_sets[self.user_position].player_hand_cards]))[::-1])
+        timers.start_game()
+        self.game_started = time.strftime("%Y%m%d_%H%M%S")
+        # 截图、识别、env.step 和模型推理都放到工作线程，界面线程只负责刷新
+        self.worker = GameWorker(self, self.env, self.user_position, self.play_order)
+        self.worker.waiting.connect(self.on_waiting)
+        self.worker.ai_played.connect(self.on_ai_played)
+        self.worker.other_played.connect(self.on_other_played)
+        self.worker.game_finished.connect(self.on_game_finished)
+        self.worker.start()
+
+    def stop_worker(self):
+        # 停止并等待当前工作线程退出；它之后才送达的信号会被各槽函数忽略
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker.wait()
+            self.worker = None
+
+    def from_current_worker(self):
+        # 信号是排队送达的，已经被替换掉的工作线程发来的信号不再处理
+        return self.worker is not None and self.sender() is self.worker
+
+    def on_waiting(self, play_order):
+        if not self.from_current_worker():
+            return
+        [self.PredictedCard, self.RPlayedCard, self.LPlayedCard][play_order].setText("...")
 
-                self.PredictedCard.setText(action_message["action"] if action_message["action"] else "不出")
-                self.WinRate.setText("胜率：" + action_message["win_rate"])
-                print("\n手牌：", str(''.join(
-                        [EnvCard2RealCard[c] for c in self.env.info_sets[self.user_position].player_hand_cards])))
-                print("出牌：", action_message["action"] if action_message["action"] else "不出", "， 胜率：",
-                      action_message["win_rate"])
-                while self.have_white(self.RPlayedCardsPos) == 1 or \
-                        pyautogui.locateOnScreen('pics/pass.png',
-                                                 region=self.RPlayedCardsPos,
-                                                 confidence=self.LandlordFlagConfidence):
-                    print("等待玩家出牌")
-                    self.counter.restart()
-                    while self.counter.elapsed() < 100:
-                        QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-                self.play_order = 1
-            elif self.play_order == 1:
-                self.RPlayedCard.setText("...")
-                pass_flag = None
-                while self.have_white(self.RPlayedCardsPos) == 0 and \
-                        not pyautogui.locateOnScreen('pics/pass.png',
-                                                     region=self.RPlayedCardsPos,
-                                                     confidence=self.LandlordFlagConfidence):
-                    print("等待下家出牌")
-                    self.counter.restart()
-                    while self.counter.elapsed() < 500:
-                        QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-                self.counter.restart()
-                while self.counter.elapsed() < 500:
-                    QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-                # 不出
-                pass_flag = pyautogui.locateOnScreen('pics/pass.png',
-                                                     region=self.RPlayedCardsPos,
-                                                     confidence=self.LandlordFlagConfidence)
-                # 未找到"不出"
-                if pass_flag is None:
-                    # 识别下家出牌
-                    self.other_played_cards_real = self.find_other_cards(self.RPlayedCardsPos)
-                # 找到"不出"
-                else:
-                    self.other_played_cards_real = ""
-                print("\n下家出牌：", self.other_played_cards_real)
-                self.other_played_cards_env = [RealCard2EnvCard[c] for c in list(self.other_played_cards_real)]
-                self.env.step(self.user_position, self.other_played_cards_env)
-                # 更新界面
-                self.RPlayedCard.setText(self.other_played_cards_real if self.other_played_cards_real else "不出")
-                self.play_order = 2
-            elif self.play_order == 2:
-                self.LPlayedCard.setText("...")
-                while self.have_white(self.LPlayedCardsPos) == 0 and \
-                        not pyautogui.locateOnScreen('pics/pass.png',
-                                                    region=self.LPlayedCardsPos,
-                                                    confidence=self.LandlordFlagConfidence):
-                    print("等待上家出牌")
-                    self.counter.restart()
-                    while self.counter.elapsed() < 500:
-                        QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-                self.counter.restart()
-                while self.counter.elapsed() < 500:
-                    QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-                # 不出
-                pass_flag = pyautogui.locateOnScreen('pics/pass.png',
-                                                     region=self.LPlayedCardsPos,
-                                                     confidence=self.LandlordFlagConfidence)
-                # 未找到"不出"
-                if pass_flag is None:
-                    # 识别上家出牌
-                    self.other_played_cards_real = self.find_other_cards(self.LPlayedCardsPos)
-                # 找到"不出"
-                else:
-                    self.other_played_cards_real = ""
-                print("\n上家出牌：", self.other_played_cards_real)
-                self.other_played_cards_env = [RealCard2EnvCard[c] for c in list(self.other_played_cards_real)]
-                self.env.step(self.user_position, self.other_played_cards_env)
-                self.play_order = 0
-                # 更新界面
-                self.LPlayedCard.setText(self.other_played_cards_real if self.other_played_cards_real else "不出")
-            else:
-                pass
+    def on_ai_played(self, hand_cards, action, win_rate):
+        if not self.from_current_worker():
+            return
+        self.UserHandCards.setText("手牌：" + hand_cards[::-1])
+        self.PredictedCard.setText(action if action else "不出")
+        self.WinRate.setText("胜率：" + win_rate)
+        self.update_timings()
+
+    def on_other_played(self, play_order, cards):
+        if not self.from_current_worker():
+            return
+        [self.PredictedCard, self.RPlayedCard, self.LPlayedCard][play_order].setText(cards if cards else "不出")
+        self.update_timings()
 
-            self.counter.restart()
-            while self.counter.elapsed() < 100:
-                QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
+    def update_timings(self):
+        if self.TimingLabel is not None:
+            self.TimingLabel.setText(timers.summary())
 
-        print("{}胜，本局结束!\n".format("农民" if self.env.winner == "farmer" else "地主"))
-        QMessageBox.information(self, "本局结束", "{}胜！".format("农民" if self.env.winner == "farmer" else "地主"),
+    def on_game_finished(self, winner):
+        if not self.from_current_worker():
+            return
+        print("{}胜，本局结束!\n".format("农民" if winner == "farmer" else "地主"))
+        self.save_timings()
+        QMessageBox.information(self, "本局结束", "{}胜！".format("农民" if winner == "farmer" else "地主"),
                                 QMessageBox.Yes, QMessageBox.Yes)
         self.env.reset()
         self.init_display()
 
-    def find_landlord(self, landlord_flag_pos):
-        for pos in landlord_flag_pos:
-            result = pyautogui.locateOnScreen('pics/landlord_words.png', region=pos, confidence=self.LandlordFlagConfidence)
-            if result is not None:
-                return landlord_flag_pos.index(pos)
-        return None
-
-    def find_three_landlord_cards(self, pos):
-        three_landlord_cards_real = ""
-        img = pyautogui.screenshot(region=pos)
-        img = img.resize((349, 168))
-        for card in AllCards:
-            result = pyautogui.locateAll(needleImage='pics/o' + card + '.png', haystackImage=img,
-                                         confidence=self.ThreeLandlordCardsConfidence)
-            three_landlord_cards_real += card[1] * self.cards_filter(list(result), self.OtherFilter)
-        return three_landlord_cards_real
-
-    def find_my_cards(self, pos):
-        user_hand_cards_real = ""
-        img = pyautogui.screenshot(region=pos)
-        for card in AllCards:
-            result = pyautogui.locateAll(needleImage='pics/m' + card + '.png', haystackImage=img, confidence=self.MyConfidence)
-            user_hand_cards_real += card[1] * self.cards_filter(list(result), self.MyFilter)
-        return user_hand_cards_real
-
-    def find_other_cards(self, pos):
-        other_played_cards_real = ""
-
-        self.counter.restart()
-        while self.counter.elapsed() < 500:
-            QtWidgets.QApplication.processEvents(QEventLoop.AllEvents, 50)
-
-        img = pyautogui.screenshot(region=pos)
-        for card in AllCards:
-            result = pyautogui.locateAll(needleImage='pics/o' + card + '.png', haystackImage=img,
-                                         confidence=self.OtherConfidence)
-            other_played_cards_real += card[1] * self.cards_filter(list(result), self.OtherFilter)
-        return other_played_cards_real
-
-    def cards_filter(self, location, distance):  # 牌检测结果滤波
-        if len(location) == 0:
-            return 0
-        locList = [location[0][0]]
-        count = 1
-        for e in location:
-            flag = 1  # “是新的”标志
-            for have in locList:
-                if abs(e[0] - have) <= distance:
-                    flag = 0
-                    break
-            if flag:
-                count += 1
-                locList.append(e[0])
-        return count
-
-    def have_white(self, pos):  # 是否有白块
-        result = pyautogui.locateOnScreen('pics/white.png', region=pos, confidence=self.WhiteConfidence)
-        if result is None:
-            return 0
-        else:
-            return 1
+    def save_timings(self):
+        # 保存本局各阶段耗时，文件名为开局时间
+        if self.TimingLogDir is None or not timers.recording:
+            return
+        os.makedirs(self.TimingLogDir, exist_ok=True)
+        path = os.path.join(self.TimingLogDir, self.game_started + "." + self.TimingLogFormat)
+        timers.save(path)
+        print("耗时记录已保存到", path)
 
     def stop(self):
-        try:
-            self.env.game_over = True
-        except AttributeError as e:
-            pass 
+        # 对局状态归工作线程所有，界面线程只通知它停止
+        if self.worker is not None:
+            self.worker.stop()
             
 
 
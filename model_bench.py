@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# 模型推理基准：在 CPU 上比较各推理后端(DeepAgent 的 backend 参数)和模型结构(model_type 参数)
+# 在不同合法动作数下的耗时，并检查输出与第一个组合是否一致。没有训练好的模型时可以用 --random 随机初始化权重。
+# two_tower 和 student 结构不能加载 lstm 的模型，需要用 --candidate_dir 指定单独训练的模型，它们的输出不做比较。
+#
+# 用法: python model_bench.py [--model_dir baselines/douzero_WP] [--random] [--batch_sizes 1,8,32,128,512]
+#                             [--model_types lstm,factored] [--candidate_dir DIR]
+#                             [--repeat 50] [--threads 1] [--json result.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+os.environ["CUDA_VISIBLE_DEVICES"] = ''  # 只测 CPU
+
+import numpy as np
+import torch
+
+from douzero.dmc.models import model_families
+from douzero.evaluation.deep_agent import DeepAgent, BACKENDS
+
+Positions = ['landlord', 'landlord_up', 'landlord_down']
+# 不能加载 lstm 模型、需要单独训练的模型结构
+SeparateModelTypes = ('two_tower', 'student')
+
+
+@contextlib.contextmanager
+def random_checkpoints(args):
+    # --random 时产出保存随机权重的临时目录，退出时连同其中的模型一起删除；否则产出 None
+    if not args.random:
+        yield None
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield tmp_dir
+
+
+def model_paths(args, model_type='lstm', tmp_dir=None):
+    if not args.random:
+        model_dir = args.model_dir
+        if model_type in SeparateModelTypes:
+            model_dir = args.candidate_dir
+        return {p: os.path.join(model_dir, p + '.ckpt') for p in Positions}
+    # 随机权重保存到 random_checkpoints 的临时目录，与真实模型走同样的加载流程；每种结构只保存一次
+    model_dir = os.path.join(tmp_dir, model_type)
+    paths = {p: os.path.join(model_dir, p + '.ckpt') for p in Positions}
+    if not os.path.isdir(model_dir):
+        os.makedirs(model_dir)
+        torch.manual_seed(0)
+        for p in Positions:
+            torch.save(model_families[model_type][p]().state_dict(), paths[p])
+    return paths
+
+
+def make_inputs(position, batch_size, rnd):
+    # 特征都是 0/1，用随机的 0/1 输入即可；与真实对局一样，只有最后 54 列(动作)每行不同
+    x_dim = 373 if position == 'landlord' else 484
+    z = torch.from_numpy(rnd.randint(0, 2, (1, 5, 162)).astype(np.float32))
+    x = rnd.randint(0, 2, (batch_size, x_dim)).astype(np.float32)
+    x[:, :-54] = x[0, :-54]
+    x = torch.from_numpy(x)
+    return z, x
+
+
+def bench(agent, z, x, repeat):
+    agent.predict(z, x)  # 预热
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        agent.predict(z, x)
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare DeepAgent inference backends and model types on CPU')
+    parser.add_argument('--model_dir', default='baselines/douzero_WP', help='Directory with the three .ckpt files')
+    parser.add_argument('--random', action='store_true', help='Use randomly initialized weights instead')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma separated backends to compare')
+    parser.add_argument('--model_types', default='lstm', help='Comma separated model types to compare')
+    parser.add_argument('--candidate_dir', default=None, help='Directory with the two_tower or student .ckpt files')
+    parser.add_argument('--batch_sizes', default='1,8,32,128,512', help='Numbers of legal actions to test')
+    parser.add_argument('--repeat', default=50, type=int, help='Timed runs per batch size')
+    parser.add_argument('--threads', default=0, type=int, help='torch.set_num_threads (0: torch default)')
+    parser.add_argument('--json', default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+    with random_checkpoints(args) as tmp_dir:
+        return run(args, tmp_dir)
+
+
+def run(args, tmp_dir):
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    backends = args.backends.split(',')
+    model_types = args.model_types.split(',')
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    paths = {t: model_paths(args, t, tmp_dir) for t in set(model_types) | {'lstm'}}
+
+    report = {}
+    print("%-14s %-19s %6s %9s %9s %9s %10s" % ('position', 'model', 'batch', 'p50(ms)', 'p95(ms)', 'speedup',
+                                              'max|diff|'))
+    for position in Positions:
+        agents = {}
+        for model_type in model_types:
+            for backend in backends:
+                agents[model_type + '/' + backend] = DeepAgent(position, paths[model_type][position],
+                                                               backend=backend, model_type=model_type)
+        reference = DeepAgent(position, paths['lstm'][position])
+        report[position] = {}
+        for batch_size in batch_sizes:
+            z, x = make_inputs(position, batch_size, np.random.RandomState(batch_size))
+            expected = reference.predict(z, x)
+            base_p50 = None
+            for name, agent in agents.items():
+                p50, p95 = np.percentile(np.array(bench(agent, z, x, args.repeat)) * 1000, [50, 95])
+                base_p50 = base_p50 or p50
+                # two_tower 和 student 的权重与 lstm 不同，输出无法比较
+                diff = float('nan')
+                if agent.model_type not in SeparateModelTypes:
+                    diff = float((agent.predict(z, x) - expected).abs().max())
+                report[position].setdefault(name, {})[batch_size] = {'p50': p50, 'p95': p95, 'max_diff': diff}
+                print("%-14s %-19s %6d %9.3f %9.3f %8.2fx %10.2e" % (position, name, batch_size, p50, p95,
+                                                                     base_p50 / p50, diff))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# 带牌裁剪基准：飞机带翅膀、四带二会枚举所有带牌组合，裁剪后每个主体只保留 N 种代价最低的带牌再送入模型。
+# 在自我对局的决策上比较裁剪前后的动作数、决策耗时和选出的动作是否一致，
+# 并在相同牌局上让裁剪的智能体与不裁剪的智能体对打，比较地主胜率。
+#
+# 用法: python prune_bench.py [--model_dir baselines/douzero_WP] [--random] [--top_n 2] [--games 50]
+#                             [--match_games 100] [--json result.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ["CUDA_VISIBLE_DEVICES"] = ''
+
+import numpy as np
+
+from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.kicker_pruning import prune_kickers
+from douzero.evaluation.self_play import agent_policy, head_to_head, self_play_infosets
+from model_bench import Positions, model_paths, random_checkpoints
+
+
+def timed_act(agent, infoset):
+    t = time.perf_counter()
+    action, _ = agent.act(infoset)
+    return action, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure kicker pruning before neural scoring')
+    parser.add_argument('--model_dir', default='baselines/douzero_WP', help='Directory with the three .ckpt files')
+    parser.add_argument('--random', action='store_true', help='Use randomly initialized weights instead')
+    parser.add_argument('--top_n', default=2, type=int, help='Kicker choices kept per main body')
+    parser.add_argument('--games', default=50, type=int, help='Self-play games to measure decisions on')
+    parser.add_argument('--match_games', default=100, type=int, help='Games per seating in the head-to-head')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--json', default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+    with random_checkpoints(args) as tmp_dir:
+        return run(args, tmp_dir)
+
+
+def run(args, tmp_dir):
+    paths = model_paths(args, tmp_dir=tmp_dir)
+    full = {p: DeepAgent(p, paths[p]) for p in Positions}
+    pruned = {p: DeepAgent(p, paths[p], kicker_top_n=args.top_n) for p in Positions}
+
+    print("自我对局 %d 局..." % args.games)
+    infosets = self_play_infosets({p: agent_policy(full[p]) for p in Positions}, args.games, args.seed)
+    actions, kept, full_s, pruned_s = [], [], [], []
+    affected = agree = 0
+    for infoset in infosets:
+        n = len(prune_kickers(infoset.legal_actions, infoset.player_hand_cards, args.top_n))
+        if n == len(infoset.legal_actions):
+            continue
+        affected += 1
+        actions.append(len(infoset.legal_actions))
+        kept.append(n)
+        a, ta = timed_act(full[infoset.player_position], infoset)
+        b, tb = timed_act(pruned[infoset.player_position], infoset)
+        agree += int(a == b)
+        full_s.append(ta)
+        pruned_s.append(tb)
+
+    report = {'decisions': len(infosets), 'pruned_decisions': affected}
+    print("共 %d 个决策，其中 %d 个有带牌被裁剪" % (len(infosets), affected))
+    if affected:
+        report.update({'actions_mean': float(np.mean(actions)), 'kept_mean': float(np.mean(kept)),
+                       'agreement': agree / affected,
+                       'full_p50_ms': float(np.median(full_s) * 1000),
+                       'pruned_p50_ms': float(np.median(pruned_s) * 1000)})
+        print("动作数 %.1f -> %.1f，选出相同动作 %.2f%%，决策耗时 p50 %.3f -> %.3f 毫秒" % (
+            report['actions_mean'], report['kept_mean'], report['agreement'] * 100,
+            report['full_p50_ms'], report['pruned_p50_ms']))
+
+    print("对打 %d 局 x 3 种座位..." % args.match_games)
+    rates = head_to_head(full, pruned, args.match_games, args.seed + 1)
+    report['landlord_win_rate'] = {'full_vs_full': rates['a_vs_a'],
+                                   'pruned_landlord': rates['b_landlord'],
+                                   'pruned_farmers': rates['b_farmers']}
+    for name, rate in report['landlord_win_rate'].items():
+        print("%-16s 地主胜率 %.2f%%" % (name, rate * 100))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# 量化校验：把对局中每个决策的 infoset 分别送入 fp32 模型和 int8 动态量化模型，
+# 统计两者选出的最佳动作一致率、胜率(价值)误差，以及推理耗时和权重占用内存的变化。
+# infoset 来自 fp32 模型的自我对局，也可以用 --infosets 读取之前用 --save_infosets 保存的记录。
+# 动态量化不需要校准数据，这里的对局记录只用于验证。
+# 用 --backend 和 --model_type 可以换成其他后端或模型结构与 fp32 lstm 模型比较，
+# 例如蒸馏出的小模型: --backend eager --model_type student --candidate_dir baselines/student_WP。
+#
+# 用法: python quantize_check.py [--model_dir baselines/douzero_WP] [--random] [--games 50]
+#                                [--backend int8] [--model_type lstm] [--candidate_dir DIR]
+#                                [--infosets infosets.pkl] [--save_infosets infosets.pkl] [--json result.json]
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+
+os.environ["CUDA_VISIBLE_DEVICES"] = ''  # 量化模型只能在 CPU 上运行
+
+import numpy as np
+import torch
+
+from douzero.env.env import get_obs
+from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.self_play import agent_policy, self_play_infosets
+from model_bench import Positions, model_paths, random_checkpoints
+
+
+def _tensors(obj):
+    # 递归取出张量；int8 模型的量化权重打包在 ScriptObject 里，通过 __getstate__ 解包
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, (tuple, list)):
+        for x in obj:
+            yield from _tensors(x)
+    elif isinstance(obj, torch.ScriptObject) and obj._has_method('__getstate__'):
+        yield from _tensors(obj.__getstate__())
+
+
+def weight_bytes(model):
+    # 模型权重在内存中占用的字节数：参数和缓冲区，int8 模型按量化后的 int8 权重计算；
+    # 冻结的 TorchScript 模型把权重折叠成了图中的常量，从常量中统计
+    objs = list(model.state_dict().values())
+    if isinstance(model, torch.jit.ScriptModule):
+        for node in model.graph.findAllNodes('prim::Constant'):
+            if node.output().type().kind() in ('TensorType', 'ClassType'):
+                objs.append(node.output().toIValue())
+    seen = set()
+    total = 0
+    for t in _tensors(objs):
+        if t.data_ptr() in seen:
+            continue
+        seen.add(t.data_ptr())
+        total += t.nelement() * t.element_size()
+    return total
+
+
+def timed_predict(agent, z, x):
+    t = time.perf_counter()
+    values = agent.predict(z, x).numpy()[:, 0]
+    return values, time.perf_counter() - t
+
+
+def check(infosets, fp32, candidate):
+    stats = {p: {'decisions': 0, 'agree': 0, 'value_diff': [], 'fp32_s': [], 'candidate_s': []} for p in Positions}
+    for infoset in infosets:
+        if len(infoset.legal_actions) < 2:
+            continue
+        s = stats[infoset.player_position]
+        obs = get_obs(infoset)
+        z = torch.from_numpy(obs['z'][np.newaxis]).float()
+        x = torch.from_numpy(obs['x_batch']).float()
+        a, ta = timed_predict(fp32[infoset.player_position], z, x)
+        b, tb = timed_predict(candidate[infoset.player_position], z, x)
+        s['decisions'] += 1
+        s['agree'] += int(a.argmax() == b.argmax())
+        s['value_diff'].append(float(np.abs(a - b).max()))
+        s['fp32_s'].append(ta)
+        s['candidate_s'].append(tb)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the int8 DeepAgent backend (or another model) against fp32')
+    parser.add_argument('--model_dir', default='baselines/douzero_WP', help='Directory with the three .ckpt files')
+    parser.add_argument('--random', action='store_true', help='Use randomly initialized weights instead')
+    parser.add_argument('--backend', default='int8', choices=['eager', 'frozen', 'int8'], help='Backend to validate')
+    parser.add_argument('--model_type', default='lstm', choices=['lstm', 'factored', 'two_tower', 'student'],
+                        help='Model type to validate')
+    parser.add_argument('--candidate_dir', default=None, help='Directory with the two_tower or student .ckpt files')
+    parser.add_argument('--games', default=50, type=int, help='Self-play games to record')
+    parser.add_argument('--seed', default=0, type=int, help='Seed for dealing the self-play games')
+    parser.add_argument('--infosets', default=None, help='Replay infosets saved with --save_infosets instead')
+    parser.add_argument('--save_infosets', default=None, help='Save the recorded infosets to this file')
+    parser.add_argument('--json', default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+    with random_checkpoints(args) as tmp_dir:
+        return run(args, tmp_dir)
+
+
+def run(args, tmp_dir):
+    paths = model_paths(args, tmp_dir=tmp_dir)
+    fp32 = {p: DeepAgent(p, paths[p]) for p in Positions}
+    candidate_paths = model_paths(args, args.model_type, tmp_dir)
+    candidate = {p: DeepAgent(p, candidate_paths[p], args.backend, args.model_type) for p in Positions}
+
+    if args.infosets:
+        with open(args.infosets, 'rb') as f:
+            infosets = pickle.load(f)
+    else:
+        print("自我对局 %d 局..." % args.games)
+        infosets = self_play_infosets({p: agent_policy(fp32[p]) for p in Positions}, args.games, args.seed)
+    if args.save_infosets:
+        with open(args.save_infosets, 'wb') as f:
+            pickle.dump(infosets, f)
+
+    stats = check(infosets, fp32, candidate)
+    report = {}
+    print("%-14s %9s %8s %12s %12s %12s %8s %12s" % ('position', 'decisions', 'agree', 'max|dv| p95',
+                                                     'fp32 p50(ms)', 'cand p50(ms)', 'speedup', 'weights(KB)'))
+    for p in Positions:
+        s = stats[p]
+        if s['decisions'] == 0:
+            continue
+        fp32_ms = float(np.median(s['fp32_s']) * 1000)
+        candidate_ms = float(np.median(s['candidate_s']) * 1000)
+        sizes = (weight_bytes(fp32[p].model), weight_bytes(candidate[p].model))
+        report[p] = {'decisions': s['decisions'],
+                     'agreement': s['agree'] / s['decisions'],
+                     'value_diff_p95': float(np.percentile(s['value_diff'], 95)),
+                     'fp32_p50_ms': fp32_ms, 'candidate_p50_ms': candidate_ms,
+                     'fp32_weight_bytes': sizes[0], 'candidate_weight_bytes': sizes[1]}
+        print("%-14s %9d %7.2f%% %12.2e %12.3f %12.3f %7.2fx %5d->%-5d" % (
+            p, s['decisions'], report[p]['agreement'] * 100, report[p]['value_diff_p95'],
+            fp32_ms, candidate_ms, fp32_ms / candidate_ms, sizes[0] // 1024, sizes[1] // 1024))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
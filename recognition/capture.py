@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# 每个时刻只截一次图：截取所有需要区域的外接矩形，各区域以 NumPy 视图的形式取出，不做拷贝
+
+import threading
+
+from douzero.timing import timers
+
+from .recognizer import load_haystack
+
+
+def union_box(regions):
+    # 多个 (x, y, w, h) 区域的外接矩形
+    left = min(r[0] for r in regions)
+    top = min(r[1] for r in regions)
+    right = max(r[0] + r[2] for r in regions)
+    bottom = max(r[1] + r[3] for r in regions)
+    return left, top, right - left, bottom - top
+
+
+class FrameProvider(object):
+    """
+    regions: {名称: (x, y, w, h)}
+    grab: 截图函数，参数为 (x, y, w, h)，返回 PIL 图片或 BGR 数组，例如 pyautogui.screenshot(region=box)
+    界面线程和出牌线程都会截图，frame、origin、captured 只在锁内读写；每次截图都换成新数组，已取出的视图不受影响
+    """
+    def __init__(self, regions, grab):
+        self.regions = dict(regions)
+        self.grab = grab
+        self.frame = None
+        self.origin = (0, 0)
+        self.captured = ()
+        self.tick = 0
+        self.lock = threading.RLock()
+
+    @timers.wrap('capture')
+    def capture(self, names=None):
+        # 截取 names 中所有区域的外接矩形(默认全部区域)，返回整帧 BGR 数组
+        names = tuple(self.regions) if names is None else tuple(names)
+        box = union_box([self.regions[name] for name in names])
+        with self.lock:
+            self.frame = load_haystack(self.grab(box))
+            self.origin = box[:2]
+            self.captured = names
+            self.tick += 1
+            return self.frame
+
+    def region(self, name):
+        # 当前帧中某个区域的视图(与整帧共享内存)
+        with self.lock:
+            if name not in self.captured:
+                raise KeyError('region %s was not captured in this frame' % name)
+            x, y, w, h = self.regions[name]
+            x -= self.origin[0]
+            y -= self.origin[1]
+            return self.frame[y:y + h, x:x + w]
+
+    def __getitem__(self, name):
+        return self.region(name)
+
+    def grabber(self, name):
+        # 返回只截取单个区域的无参函数，供 RegionWatcher 使用
+        def grab():
+            # 截图和取视图之间不能被其它线程的截图打断
+            with self.lock:
+                self.capture([name])
+                return self.region(name)
+        return grab
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# 识别相关的参数、截图坐标和识别函数。界面(main.py)与离线回放(replay_bench.py)共用同一套实现
+
+import numpy as np
+from PIL import Image
+
+from .capture import FrameProvider
+from .recognizer import CardRecognizer, RankCardRecognizer, locate
+from .templates import TemplateBank
+
+AllCards = ['rD', 'bX', 'b2', 'r2', 'bA', 'rA', 'bK', 'rK', 'bQ', 'rQ', 'bJ', 'rJ', 'bT', 'rT',
+            'b9', 'r9', 'b8', 'r8', 'b7', 'r7', 'b6', 'r6', 'b5', 'r5', 'b4', 'r4', 'b3', 'r3']
+
+
+class CardReader(object):
+    """
+    以 mixin 的方式使用：调用 init_reader 之后即可使用各个 find_* 函数。
+    grab: 截图函数，参数为 (x, y, w, h)
+    """
+    def init_reader(self, grab, pics_dir='pics', cache_path='pics/templates_cache.npz', rank_templates=True,
+                    pyramid=False):
+        # 参数
+        self.MyConfidence = 0.95  # 我的牌的置信度
+        self.OtherConfidence = 0.9  # 别人的牌的置信度
+        self.WhiteConfidence = 0.9  # 检测白块的置信度
+        self.LandlordFlagConfidence = 0.9     # # 检测地主标志的置信度
+        self.ThreeLandlordCardsConfidence = 0.9  # 检测地主底牌的置信度
+        self.MyFilter = 40  # 我的牌检测结果过滤参数
+        self.OtherFilter = 25  # 别人的牌检测结果过滤参数
+        self.RankTemplates = rank_templates  # 使用不分花色的点数模板(每个点数只匹配一次)，否则红黑两种花色分别匹配
+        # 先在缩小的图上粗匹配，只在候选位置做原尺寸匹配。近似算法，可能漏检，
+        # 在真实截图上用 replay_bench.py --pyramid-check 确认与原尺寸匹配一致之前默认关闭
+        self.PyramidMatch = pyramid
+        self.CoarseMargin = 0.25  # 粗匹配阈值比置信度低多少，越大漏检越少但越慢
+
+        # 坐标
+        self.MyHandCardsPos = (414, 804, 1041, 59)  # 我的截图区域
+        self.LPlayedCardsPos = (530, 470, 380, 160)  # 左边截图区域
+        self.RPlayedCardsPos = (1010, 470, 380, 160)  # 右边截图区域
+        self.LandlordFlagPos = [(1320, 300, 110, 140), (320, 720, 110, 140), (500, 300, 110, 140)]  # 地主标志截图区域(右-我-左)
+        self.ThreeLandlordCardsPos = (817, 36, 287, 136)      # 地主底牌截图区域，resize成349x168
+
+        # 模板库与识别器(所有图片在启动时一次性读入，之后从缓存文件加载)
+        self.Templates = TemplateBank(pics_dir, cache_path=cache_path)
+        cls = RankCardRecognizer if self.RankTemplates else CardRecognizer
+
+        def recognizer(prefix, confidence, distance):
+            return cls(self.Templates, prefix, AllCards, confidence, distance,
+                       pyramid=self.PyramidMatch, coarse_margin=self.CoarseMargin)
+        self.MyCardsRecognizer = recognizer('m', self.MyConfidence, self.MyFilter)
+        self.OtherCardsRecognizer = recognizer('o', self.OtherConfidence, self.OtherFilter)
+        self.ThreeLandlordCardsRecognizer = recognizer('o', self.ThreeLandlordCardsConfidence, self.OtherFilter)
+
+        # 截图：所有区域共用一次截图
+        regions = {'MyHandCards': self.MyHandCardsPos,
+                   'LPlayedCards': self.LPlayedCardsPos,
+                   'RPlayedCards': self.RPlayedCardsPos,
+                   'ThreeLandlordCards': self.ThreeLandlordCardsPos}
+        for i, pos in enumerate(self.LandlordFlagPos):
+            regions['LandlordFlag%d' % i] = pos
+        self.Frames = FrameProvider(regions, grab)
+
+    def find_landlord(self, landlord_flag_imgs):
+        for i, img in enumerate(landlord_flag_imgs):
+            result = locate(img, self.Templates.get('landlord_words'), self.LandlordFlagConfidence)
+            if result is not None:
+                return i
+        return None
+
+    def find_three_landlord_cards(self, img):
+        # 与原来一样用 PIL 缩放，保持识别结果不变
+        img = Image.fromarray(np.ascontiguousarray(img[:, :, ::-1])).resize((349, 168))
+        return self.ThreeLandlordCardsRecognizer.recognize_str(img)
+
+    def find_my_cards(self, img):
+        return self.MyCardsRecognizer.recognize_str(img)
+
+    def find_other_cards(self, img):
+        return self.OtherCardsRecognizer.recognize_str(img)
+
+    def have_white(self, img):  # 是否有白块
+        result = locate(img, self.Templates.get('white'), self.WhiteConfidence)
+        if result is None:
+            return 0
+        else:
+            return 1
+
+    def find_pass(self, img):  # 是否有"不出"
+        return locate(img, self.Templates.get('pass'), self.LandlordFlagConfidence)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+# 一次截图、一次遍历完成所有牌面模板的匹配，替代逐张牌调用 pyautogui.locateAll
+# 默认按彩色匹配(与 requirements 中 pyautogui 版本的行为一致)，灰度下红黑两种花色无法区分
+
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from douzero.timing import timers
+
+PyramidScale = 2  # 粗匹配时的缩小倍数
+
+
+def load_haystack(img, grayscale=False):
+    # 把截图统一转换成 OpenCV 格式(与 pyscreeze 的处理方式一致)，每个区域只转换一次
+    if isinstance(img, np.ndarray):
+        img_cv = img
+        if grayscale and img_cv.ndim == 3:
+            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+    elif hasattr(img, 'convert'):
+        img_cv = np.array(img.convert('RGB'))[:, :, ::-1]  # RGB -> BGR
+        if grayscale:
+            img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+        else:
+            img_cv = np.ascontiguousarray(img_cv)
+    else:
+        raise TypeError('expected an OpenCV numpy array or PIL image')
+    return img_cv
+
+
+@timers.wrap('locate')
+def locate(img, template, confidence):
+    # 单模板检测，返回第一个匹配位置 (x, y, w, h)，没有则返回 None，用于白块、"不出"、地主标志
+    haystack = load_haystack(img, template.ndim == 2)
+    h, w = template.shape[:2]
+    if haystack.shape[0] < h or haystack.shape[1] < w:
+        raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+    result = cv2.matchTemplate(haystack, template, cv2.TM_CCOEFF_NORMED)
+    ys, xs = np.nonzero(result > confidence)
+    if len(ys) == 0:
+        return None
+    return xs[0], ys[0], w, h
+
+
+@timers.wrap('cards_filter')
+def suppress(xs, scores, distance):
+    # 非极大值抑制：按得分从高到低，保留一个点后去掉 x 方向 distance 以内的其它点，返回保留点的下标
+    if len(xs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(-scores, kind='stable')
+    xs = xs[order]
+    alive = np.ones(len(xs), dtype=bool)
+    keep = []
+    i = 0
+    while i < len(xs):
+        keep.append(i)
+        alive &= np.abs(xs - xs[i]) > distance
+        remaining = np.flatnonzero(alive)
+        if len(remaining) == 0:
+            break
+        i = remaining[0]
+    return order[keep]
+
+
+def cards_filter(labels, xs, scores, distance, num_labels):  # 牌检测结果滤波
+    # 所有模板的命中点一起做非极大值抑制(不论属于哪个模板)，再按 labels 统计张数
+    counts = np.zeros(num_labels, dtype=np.int64)
+    np.add.at(counts, labels[suppress(xs, scores, distance)], 1)
+    return counts
+
+
+class CardRecognizer(object):
+    """
+    一个区域对应一个识别器。模板取自共享的模板库，识别时截图只转换一次，
+    所有模板的匹配结果写入同一个得分数组，再统一取阈值、过滤，得到每种点数的张数。
+    """
+    def __init__(self, bank, prefix, cards, confidence, distance, grayscale=False,
+                 pyramid=False, coarse_margin=0.25):
+        self.cards = cards
+        self.confidence = confidence
+        self.distance = distance
+        self.grayscale = grayscale
+        self.templates = [bank.get(prefix + card, grayscale) for card in cards]
+        # 红黑两种花色对应同一个点数
+        self.ranks = list(OrderedDict.fromkeys(card[1] for card in cards))
+        self.rank_index = np.array([self.ranks.index(card[1]) for card in cards])
+        self.init_pyramid(pyramid, coarse_margin)
+
+    def init_pyramid(self, pyramid, coarse_margin):
+        # pyramid: 先在缩小一半的图上粗匹配找出候选 x 坐标，再只在候选附近做原尺寸匹配。
+        # 这是近似算法：原尺寸得分超过 confidence、但缩小后得分不超过 coarse_confidence 的命中会被漏掉
+        # coarse_margin: 粗匹配的阈值比 confidence 低多少，用召回率换速度：越大越不容易漏检，但候选窗口越多、越慢
+        # 改动参数后可以用 replay_bench.py --pyramid-check 在录好的截图上对比与原尺寸全图匹配的一致率
+        self.min_h = min(t.shape[0] for t in self.templates)
+        self.min_w = min(t.shape[1] for t in self.templates)
+        self.pyramid = pyramid
+        self.coarse_confidence = self.confidence - coarse_margin
+        self.coarse_templates = [_downscale(t) for t in self.templates]
+
+    def match(self, img):
+        # 返回 (模板数, H, W) 的得分数组，尺寸不同的模板用 -1 补齐
+        # 金字塔匹配时只有候选窗口内是原尺寸的匹配得分，其余位置为 -1
+        haystack = load_haystack(img, self.grayscale)
+        height, width = haystack.shape[:2]
+        if height < self.min_h or width < self.min_w:
+            raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+        scores = np.full((len(self.templates), height - self.min_h + 1, width - self.min_w + 1),
+                         -1, dtype=np.float32)
+        small = _downscale(haystack) if self.pyramid else None
+        for i, template in enumerate(self.templates):
+            h, w = template.shape[:2]
+            if h > height or w > width:
+                continue
+            coarse = self.coarse_templates[i]
+            if small is None or coarse.shape[0] > small.shape[0] or coarse.shape[1] > small.shape[1]:
+                result = cv2.matchTemplate(haystack, template, cv2.TM_CCOEFF_NORMED)
+                scores[i, :result.shape[0], :result.shape[1]] = result
+                continue
+            for x0, x1 in self._candidate_windows(small, coarse, width - w):
+                result = cv2.matchTemplate(haystack[:, x0:x1 + w], template, cv2.TM_CCOEFF_NORMED)
+                scores[i, :result.shape[0], x0:x1 + 1] = result
+        return scores
+
+    def _candidate_windows(self, small, coarse, max_x):
+        # 粗匹配得分超过 coarse_confidence 的列映射回原尺寸，左右各扩展 PyramidScale 个像素，
+        # 相邻的窗口合并，返回 [(x0, x1)]，x0、x1 为原尺寸下模板左上角的取值范围(含两端)
+        best = cv2.matchTemplate(small, coarse, cv2.TM_CCOEFF_NORMED).max(axis=0)
+        cols = np.flatnonzero(best > self.coarse_confidence)
+        windows = []
+        for c in cols.tolist():
+            x0 = max(c * PyramidScale - PyramidScale, 0)
+            x1 = min(c * PyramidScale + PyramidScale, max_x)
+            if windows and x0 <= windows[-1][1] + 1:
+                windows[-1][1] = x1
+            else:
+                windows.append([x0, x1])
+        return windows
+
+    def recognize(self, img):
+        # 返回每种点数的张数，顺序与 cards 一致，例如 {'D': 1, 'X': 0, '2': 2, ...}
+        with timers.timed('match'):
+            scores = self.match(img)
+        # 过滤只看 x 坐标，先在 y 方向取最大值，命中点数量从 模板数*H*W 降到 模板数*W
+        best = scores.max(axis=1)
+        t_idx, x_idx = np.nonzero(best > self.confidence)
+        counts = cards_filter(self.rank_index[t_idx], x_idx, best[t_idx, x_idx],
+                              self.distance, len(self.ranks))
+        return OrderedDict(zip(self.ranks, counts.tolist()))
+
+    def recognize_str(self, img):
+        return ''.join(rank * num for rank, num in self.recognize(img).items())
+
+
+def _downscale(img):
+    # 缩小 PyramidScale 倍，用于粗匹配
+    h, w = img.shape[:2]
+    return cv2.resize(img, (max(w // PyramidScale, 1), max(h // PyramidScale, 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _normalize(gray):
+    gray = gray.astype(np.float32)
+    return (gray - gray.mean()) / max(float(gray.std()), 1e-6)
+
+
+def _red_excess(patch):
+    # 红色程度：R 通道均值减去 G 通道均值，用于区分大小王
+    return float(patch[:, :, 2].mean()) - float(patch[:, :, 1].mean())
+
+
+class RankCardRecognizer(CardRecognizer):
+    """
+    不分花色的识别器：红黑两种花色的模板在灰度(归一化后)下几乎相同，合并成一个点数模板，
+    每个点数只匹配一次。合并后的相关系数低于 merge_threshold 的花色仍保留各自的模板。
+    大小王在灰度下无法区分，共用一个模板，命中后再按颜色判断是大王还是小王。
+    """
+    def __init__(self, bank, prefix, cards, confidence, distance, merge_threshold=0.98,
+                 pyramid=False, coarse_margin=0.25):
+        self.cards = cards
+        self.confidence = confidence
+        self.distance = distance
+        self.grayscale = True
+        self.ranks = list(OrderedDict.fromkeys(card[1] for card in cards))
+        # 大小王共用标签 -1
+        jokers = [card for card in cards if card[1] in ('D', 'X')]
+        self.joker_ranks = [card[1] for card in jokers]
+        self.joker_red = [_red_excess(bank.get(prefix + card)) for card in jokers]
+
+        groups = OrderedDict()
+        for card in cards:
+            label = -1 if card in jokers else self.ranks.index(card[1])
+            groups.setdefault(label, []).append(_normalize(bank.get(prefix + card, True)))
+        self.templates = []
+        labels = []
+        for label, variants in groups.items():
+            merged = []  # [[模板之和, 个数, 第一个模板]]
+            for v in variants:
+                for m in merged:
+                    if m[2].shape == v.shape and float((m[2] * v).mean()) >= merge_threshold:
+                        m[0] += v
+                        m[1] += 1
+                        break
+                else:
+                    merged.append([v.copy(), 1, v])
+            for total, num, _ in merged:
+                self.templates.append(total / num)
+                labels.append(label)
+        self.labels = np.array(labels)
+        self.init_pyramid(pyramid, coarse_margin)
+
+    def match(self, img):
+        gray = load_haystack(img, grayscale=True).astype(np.float32)
+        return super(RankCardRecognizer, self).match(gray)
+
+    def recognize(self, img):
+        haystack = load_haystack(img)
+        with timers.timed('match'):
+            scores = self.match(haystack)
+        best = scores.max(axis=1)
+        t_idx, x_idx = np.nonzero(best > self.confidence)
+        keep = suppress(x_idx, best[t_idx, x_idx], self.distance)
+        counts = OrderedDict((rank, 0) for rank in self.ranks)
+        for k in keep:
+            label = self.labels[t_idx[k]]
+            if label >= 0:
+                counts[self.ranks[label]] += 1
+                continue
+            # 大小王：取命中位置的图块，红色程度更接近哪个模板就是哪张
+            t = self.templates[t_idx[k]]
+            y = int(scores[t_idx[k], :, x_idx[k]].argmax())
+            patch = haystack[y:y + t.shape[0], x_idx[k]:x_idx[k] + t.shape[1]]
+            red = _red_excess(patch)
+            j = int(np.argmin([abs(red - r) for r in self.joker_red]))
+            counts[self.joker_ranks[j]] += 1
+        return counts
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# 模板库：启动时一次性读入 pics 下所有图片，预先算好彩色图和灰度图，
+# 供所有识别函数共享。解码结果保存在缓存文件中，再次启动时直接读取，不再解码 PNG。
+# 与 pyscreeze 一样忽略透明通道(用到的模板 pass、landlord_words 的透明通道都是全不透明)。
+
+import os
+import json
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+Template = namedtuple('Template', ['name', 'color', 'gray'])
+
+CACHE_VERSION = 2
+
+
+def _make_template(name, img):
+    # img 为 cv2.IMREAD_UNCHANGED 读入的图片，可能带透明通道
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    color = np.ascontiguousarray(img[:, :, :3])
+    gray = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+    return Template(name, color, gray)
+
+
+class TemplateBank(object):
+    """
+    模板按文件名(不含扩展名)索引，例如 bank['mrA']、bank['pass']。
+    cache_path 为 None 时不使用缓存。
+    """
+    def __init__(self, pics_dir='pics', cache_path=None):
+        self.pics_dir = pics_dir
+        self.cache_path = cache_path
+        self.templates = {}
+        self.from_cache = False
+
+        files = sorted(f for f in os.listdir(pics_dir) if f.lower().endswith('.png'))
+        signature = self._signature(files)
+        if cache_path is not None and os.path.exists(cache_path):
+            self.from_cache = self._load_cache(signature)
+        if not self.from_cache:
+            for f in files:
+                path = os.path.join(pics_dir, f)
+                img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+                if img is None:
+                    raise IOError("Failed to read %s" % path)
+                name = os.path.splitext(f)[0]
+                self.templates[name] = _make_template(name, img)
+            if cache_path is not None:
+                self._save_cache(signature)
+
+    def __getitem__(self, name):
+        return self.templates[name]
+
+    def __contains__(self, name):
+        return name in self.templates
+
+    def get(self, name, grayscale=False):
+        template = self.templates[name]
+        return template.gray if grayscale else template.color
+
+    def _signature(self, files):
+        # 图片有增删或修改时缓存失效
+        sig = [CACHE_VERSION]
+        for f in files:
+            st = os.stat(os.path.join(self.pics_dir, f))
+            sig.append([f, st.st_size, st.st_mtime_ns])
+        return json.dumps(sig)
+
+    def _save_cache(self, signature):
+        arrays = {'__signature__': np.array(signature)}
+        for name, t in self.templates.items():
+            arrays[name + '/color'] = t.color
+            arrays[name + '/gray'] = t.gray
+        tmp_path = self.cache_path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.cache_path)
+
+    def _load_cache(self, signature):
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                if str(data['__signature__']) != signature:
+                    return False
+                for key in data.files:
+                    if not key.endswith('/color'):
+                        continue
+                    name = key[:-len('/color')]
+                    self.templates[name] = Template(name, data[key], data[name + '/gray'])
+        except (OSError, KeyError, ValueError):
+            self.templates = {}
+            return False
+        return True
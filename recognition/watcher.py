@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# 出牌区域变化监视：按固定频率截图，只比较缩小后的灰度图，
+# 区域内容发生变化并稳定下来(“区域已稳定”事件)时才交给模板匹配处理
+
+import time
+
+import cv2
+import numpy as np
+
+from .recognizer import load_haystack
+
+
+def fingerprint(img, scale=8):
+    # 缩小 scale 倍的灰度图，用于快速比较两帧是否相同
+    gray = load_haystack(img, grayscale=True)
+    h, w = gray.shape[:2]
+    return cv2.resize(gray, (max(w // scale, 1), max(h // scale, 1)),
+                      interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def frame_diff(a, b):
+    # 两个缩略图的平均灰度差
+    return float(np.abs(a - b).mean())
+
+
+class RegionWatcher(object):
+    """
+    grab: 无参数函数，返回区域截图
+    interval: 采样间隔(秒)
+    settle_frames: 连续多少次采样不变才算稳定
+    threshold: 平均灰度差超过该值才算变化
+    """
+    def __init__(self, grab, interval=0.05, settle_frames=2, threshold=2.0, scale=8):
+        self.grab = grab
+        self.interval = interval
+        self.settle_frames = settle_frames
+        self.threshold = threshold
+        self.scale = scale
+
+    def settled_frames(self, idle=None, should_stop=None):
+        # 生成器：每当区域内容变化并稳定下来，产出一次稳定后的截图(开始监视时的第一个稳定画面也会产出)
+        idle = idle or time.sleep
+        last_emitted = None
+        prev = None
+        stable = 0
+        while should_stop is None or not should_stop():
+            frame = self.grab()
+            fp = fingerprint(frame, self.scale)
+            if prev is not None and frame_diff(fp, prev) <= self.threshold:
+                stable += 1
+            else:
+                stable = 0
+            prev = fp
+            if stable >= self.settle_frames and \
+                    (last_emitted is None or frame_diff(fp, last_emitted) > self.threshold):
+                last_emitted = fp
+                yield frame
+                continue
+            idle(self.interval)
+
+    def wait_until(self, predicate, idle=None, should_stop=None):
+        # 阻塞直到某个稳定画面满足 predicate，返回该画面；should_stop 为真时返回 None
+        for frame in self.settled_frames(idle, should_stop):
+            if predicate(frame):
+                return frame
+        return None
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# 离线回放：读取录好的全屏截图和标注，用 main.py 相同的识别函数逐帧识别，
+# 统计各区域的识别准确率以及各阶段耗时的 p50/p95/p99。不需要游戏客户端和图形界面。
+#
+# 标注文件(默认是截图目录下的 labels.json)格式如下，每张截图只需标注关心的区域：
+# {
+#     "1.png": {
+#         "MyHandCards": "DX2AKKQJT99887654333",  # 我的手牌
+#         "ThreeLandlordCards": "2XD",             # 三张底牌
+#         "Landlord": 1,                           # 地主标志位置：0-右, 1-我, 2-左, null-没有
+#         "LPlayedCards": "33",                    # 出牌区域："" 表示“不出”，null 表示空
+#         "RPlayedCards": null
+#     }
+# }
+#
+# 用法: python replay_bench.py 截图目录 [--labels labels.json] [--repeat 5] [--json result.json] [--compare] [--pyramid]
+#                               [--pyramid-check]
+# --compare 会再用红黑花色分别匹配的模板跑一遍，对比两者的准确率和耗时
+# --pyramid 打开粗到细的金字塔匹配(默认关闭，每个模板都在整个区域上做原尺寸匹配)
+# --pyramid-check 金字塔匹配是近似算法，粗匹配得分低于 置信度-CoarseMargin 的牌会漏检。
+#                 该选项对每张截图的每个标注区域分别用金字塔匹配和原尺寸全图匹配识别，统计两者结果一致的比例
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from recognition.reader import CardReader
+
+PlayedRegions = ['LPlayedCards', 'RPlayedCards']
+
+
+class ReplayReader(CardReader):
+    def __init__(self, pics_dir='pics', rank_templates=True, pyramid=False):
+        self.screen = None
+        self.init_reader(self.grab, pics_dir=pics_dir, cache_path=None, rank_templates=rank_templates,
+                         pyramid=pyramid)
+
+    def grab(self, box):
+        x, y, w, h = box
+        return self.screen[y:y + h, x:x + w]
+
+
+def same_cards(a, b):
+    return a is None and b is None or a is not None and b is not None and sorted(a) == sorted(b)
+
+
+def read_played(reader, img, timings):
+    # 与 main.py 的出牌循环一致：先看“不出”，再看是否有牌
+    t = time.perf_counter()
+    pass_flag = reader.find_pass(img)
+    white = reader.have_white(img)
+    timings['played_state'].append(time.perf_counter() - t)
+    if pass_flag is not None:
+        return ""
+    if white == 0:
+        return None
+    t = time.perf_counter()
+    cards = reader.find_other_cards(img)
+    timings['other_cards'].append(time.perf_counter() - t)
+    return cards
+
+
+def replay(frames_dir, labels, repeat=1, verbose=False, rank_templates=True, pyramid=False):
+    reader = ReplayReader(rank_templates=rank_templates, pyramid=pyramid)
+    timings = defaultdict(list)
+    correct = defaultdict(int)
+    total = defaultdict(int)
+    for name in sorted(labels):
+        screen = cv2.imread(os.path.join(frames_dir, name), cv2.IMREAD_COLOR)
+        if screen is None:
+            print("无法读取截图 %s" % name)
+            continue
+        reader.screen = screen
+        label = labels[name]
+        for r in range(repeat):
+            result = {}
+            t = time.perf_counter()
+            reader.Frames.capture()
+            timings['capture'].append(time.perf_counter() - t)
+            if 'MyHandCards' in label:
+                t = time.perf_counter()
+                result['MyHandCards'] = reader.find_my_cards(reader.Frames['MyHandCards'])
+                timings['my_cards'].append(time.perf_counter() - t)
+            if 'ThreeLandlordCards' in label:
+                t = time.perf_counter()
+                result['ThreeLandlordCards'] = reader.find_three_landlord_cards(reader.Frames['ThreeLandlordCards'])
+                timings['three_landlord_cards'].append(time.perf_counter() - t)
+            if 'Landlord' in label:
+                t = time.perf_counter()
+                result['Landlord'] = reader.find_landlord(
+                    [reader.Frames['LandlordFlag%d' % i] for i in range(len(reader.LandlordFlagPos))])
+                timings['landlord'].append(time.perf_counter() - t)
+            for region in PlayedRegions:
+                if region in label:
+                    result[region] = read_played(reader, reader.Frames[region], timings)
+            if r > 0:
+                continue
+            for region, value in result.items():
+                ok = result[region] == label[region] if region == 'Landlord' else \
+                    same_cards(result[region], label[region])
+                total[region] += 1
+                correct[region] += ok
+                if verbose and not ok:
+                    print("%s %s: 识别为 %r，标注为 %r" % (name, region, result[region], label[region]))
+    return correct, total, timings
+
+
+def pyramid_agreement(frames_dir, labels, rank_templates=True, verbose=False):
+    # 与标注无关：只比较金字塔匹配和原尺寸全图匹配的识别结果是否相同
+    readers = [ReplayReader(rank_templates=rank_templates, pyramid=p) for p in (True, False)]
+    timings = defaultdict(list)
+    same = defaultdict(int)
+    total = defaultdict(int)
+    for name in sorted(labels):
+        screen = cv2.imread(os.path.join(frames_dir, name), cv2.IMREAD_COLOR)
+        if screen is None:
+            print("无法读取截图 %s" % name)
+            continue
+        results = []
+        for reader in readers:
+            reader.screen = screen
+            reader.Frames.capture()
+            result = {}
+            if 'MyHandCards' in labels[name]:
+                result['MyHandCards'] = reader.find_my_cards(reader.Frames['MyHandCards'])
+            if 'ThreeLandlordCards' in labels[name]:
+                result['ThreeLandlordCards'] = reader.find_three_landlord_cards(
+                    reader.Frames['ThreeLandlordCards'])
+            for region in PlayedRegions:
+                if region in labels[name]:
+                    result[region] = read_played(reader, reader.Frames[region], timings)
+            results.append(result)
+        for region, value in results[0].items():
+            ok = same_cards(value, results[1][region])
+            total[region] += 1
+            same[region] += ok
+            if verbose and not ok:
+                print("%s %s: 金字塔匹配为 %r，全图匹配为 %r" % (name, region, value, results[1][region]))
+    return same, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded screenshots through the card recognizers')
+    parser.add_argument('frames_dir', help='Directory of full-screen screenshots')
+    parser.add_argument('--labels', default=None, help='Ground-truth labels (default: <frames_dir>/labels.json)')
+    parser.add_argument('--repeat', default=1, type=int, help='Times to run each frame, for more latency samples')
+    parser.add_argument('--json', default=None, help='Also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='Print every misrecognized region')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also run the per-color (28 template) path and report both')
+    parser.add_argument('--pyramid', action='store_true',
+                        help='Match coarse-to-fine instead of every template over the full region')
+    parser.add_argument('--pyramid-check', dest='pyramid_check', action='store_true',
+                        help='Report how often coarse-to-fine matching agrees with the full-resolution pass')
+    args = parser.parse_args()
+
+    labels_path = args.labels or os.path.join(args.frames_dir, 'labels.json')
+    with open(labels_path, encoding='utf-8') as f:
+        labels = json.load(f)
+
+    if args.pyramid_check:
+        same, total = pyramid_agreement(args.frames_dir, labels, verbose=args.verbose)
+        report = {}
+        print("%-20s %8s %8s" % ('region', 'same', 'agree'))
+        for region in sorted(total):
+            rate = same[region] / total[region]
+            report[region] = {'same': same[region], 'total': total[region], 'agreement': rate}
+            print("%-20s %4d/%-4d %7.2f%%" % (region, same[region], total[region], rate * 100))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'pyramid_agreement': report}, f, indent=2, ensure_ascii=False)
+        return 0 if sum(same.values()) == sum(total.values()) else 1
+
+    modes = [('rank', True), ('color', False)] if args.compare else [('rank', True)]
+    reports = {}
+    all_correct = True
+    for mode, rank_templates in modes:
+        correct, total, timings = replay(args.frames_dir, labels, args.repeat, args.verbose, rank_templates,
+                                         args.pyramid)
+        all_correct = all_correct and sum(correct.values()) == sum(total.values())
+        reports[mode] = print_report(mode, correct, total, timings)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports if args.compare else reports['rank'], f, indent=2, ensure_ascii=False)
+    return 0 if all_correct else 1
+
+
+def print_report(mode, correct, total, timings):
+    report = {'accuracy': {}, 'latency_ms': {}}
+    print("[%s templates]" % mode)
+    print("%-20s %8s %8s" % ('region', 'correct', 'acc'))
+    for region in sorted(total):
+        acc = correct[region] / total[region]
+        report['accuracy'][region] = {'correct': correct[region], 'total': total[region], 'accuracy': acc}
+        print("%-20s %4d/%-4d %7.2f%%" % (region, correct[region], total[region], acc * 100))
+    print()
+    print("%-20s %6s %8s %8s %8s" % ('stage', 'n', 'p50(ms)', 'p95(ms)', 'p99(ms)'))
+    for stage, values in timings.items():
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        report['latency_ms'][stage] = {'n': len(values), 'p50': p50, 'p95': p95, 'p99': p99}
+        print("%-20s %6d %8.2f %8.2f %8.2f" % (stage, len(values), p50, p95, p99))
+    print()
+    return report
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# 自我对局吞吐量基准：多个线程同时对局，比较每个智能体单独推理(direct)与跨对局批量推理(batched)
+# 每分钟能完成的对局数。没有训练好的模型时可以用 --random 随机初始化权重。
+#
+# 用法: python selfplay_bench.py [--model_dir baselines/douzero_WP] [--random] [--games 200] [--threads 16]
+#                               [--mode both] [--max_batch 2048] [--max_wait 0.002] [--backend eager]
+
+import sys
+import time
+import random
+import argparse
+import threading
+
+from douzero.env.env import action_cache
+from douzero.env.game import GameEnv
+from douzero.evaluation.deep_agent import DeepAgent
+from douzero.evaluation.batched_inference import BatchedInference, BatchedAgent
+from douzero.evaluation.self_play import agent_policy, deal, play_game
+from model_bench import Positions, model_paths, random_checkpoints
+
+
+def run(make_agent, num_games, num_threads, seed):
+    # 每个线程有自己的 GameEnv 和智能体，对局从共享计数器中领取
+    counter = iter(range(num_games))
+    lock = threading.Lock()
+    decisions = [0]
+
+    def worker():
+        env = GameEnv([None, None])
+        policies = {p: agent_policy(make_agent(p)) for p in Positions}
+        while True:
+            with lock:
+                game = next(counter, None)
+            if game is None:
+                return
+            moves = []
+            play_game(env, policies, deal(random.Random(seed + game)),
+                      on_decision=lambda infoset, action: moves.append(action))
+            with lock:
+                decisions[0] += len(moves)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    t = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t, decisions[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Self-play throughput with and without batched inference')
+    parser.add_argument('--model_dir', default='baselines/douzero_WP', help='Directory with the three .ckpt files')
+    parser.add_argument('--random', action='store_true', help='Use randomly initialized weights instead')
+    parser.add_argument('--games', default=200, type=int, help='Number of games to play')
+    parser.add_argument('--threads', default=16, type=int, help='Number of concurrent games')
+    parser.add_argument('--mode', default='both', choices=['direct', 'batched', 'both'])
+    parser.add_argument('--backend', default='eager', choices=['eager', 'int8'])
+    parser.add_argument('--max_batch', default=2048, type=int, help='Max actions per batched forward pass')
+    parser.add_argument('--max_wait', default=0.002, type=float, help='Max seconds a request waits for a batch')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+    with random_checkpoints(args) as tmp_dir:
+        return run_modes(args, tmp_dir)
+
+
+def run_modes(args, tmp_dir):
+    paths = model_paths(args, tmp_dir=tmp_dir)
+    modes = ['direct', 'batched'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        service = None
+        if mode == 'direct':
+            def make_agent(p):
+                return DeepAgent(p, paths[p], args.backend)
+        else:
+            service = BatchedInference(paths, args.backend, args.max_batch, args.max_wait)
+
+            def make_agent(p):
+                return BatchedAgent(p, service)
+        action_cache.reset_stats()
+        elapsed, decisions = run(make_agent, args.games, args.threads, args.seed)
+        print("%-8s %d 局 %.1f 秒，%.0f 局/分钟，%.0f 次决策/秒" % (mode, args.games, elapsed,
+                                                         args.games / elapsed * 60, decisions / elapsed))
+        stats = action_cache.stats()
+        print("         动作编码缓存命中率 %.2f%%，缓存 %d 种动作" % (stats['hit_rate'] * 100, stats['size']))
+        if service is not None:
+            stats = service.stats()
+            print("         每批平均 %.1f 个决策、%.1f 个动作，共 %d 批" % (
+                stats['requests_per_batch'], stats['actions_per_batch'], stats['batches']))
+            service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())